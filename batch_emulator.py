@@ -0,0 +1,279 @@
+import numpy as np
+from array import array
+from emulator import Emulator
+from image import is_segmented, read_segments
+
+class BatchEmulator:
+    def __init__(self, count):
+        self.count = count
+        self.program_counter = np.zeros(count, np.int64)
+        self.registers = np.zeros((count, 16), np.uint8)
+        self.memory = np.zeros((count, 65536), np.uint8)
+        self.carry = np.zeros(count, np.uint8)
+        self.zero = np.zeros(count, np.uint8)
+        self.interrupt = np.zeros(count, np.uint8)
+        self.interrupt_enable = np.zeros(count, np.uint8)
+        self.halted = np.zeros(count, bool)
+        # division by zero and illegal opcodes raise in Emulator; here
+        # they halt the machine and set its fault flag instead
+        self.faulted = np.zeros(count, bool)
+        self.steps = np.zeros(count, np.int64)
+        self.functions = [
+            self.add, self.sub, self.mul, self.div,
+            self.shl, self.shr, self.and_, self.orr,
+            self.xor, self.not_, self.psh, self.pop,
+            self.cal, self.ret, self.jmp, self.jif,
+            self.lod, self.lod, self.ldi, self.ldi,
+            self.sto, self.sto, self.inc, self.dec,
+            self.cmp, self.nop, self.hlt, self.mov,
+            self.rti, self.sei, self.cli, self.illegal,
+        ]
+        self.lengths = np.array([length for _, length in Emulator().table], np.int64)
+
+    def load(self, programs):
+        if isinstance(programs, (bytes, bytearray, memoryview)):
+            programs = [programs]*self.count
+        for i, program in enumerate(programs):
+            if is_segmented(program):
+                # like Emulator.load_image, the gaps between segments read
+                # as zeros
+                segments = read_segments(program)
+                end = max([base+len(data) for base, data in segments], default=0)
+                self.memory[i, :end] = 0
+                for base, data in segments:
+                    self.memory[i, base:base+len(data)] = np.frombuffer(data, np.uint8)
+                continue
+            program = np.frombuffer(program, np.uint8)
+            self.memory[i, :len(program)] = program
+        self.program_counter[:] = 0
+        self.registers[:, 0xf] = 0
+        self.interrupt[:] = 0
+        self.interrupt_enable[:] = 0
+        self.halted[:] = False
+        self.faulted[:] = False
+        self.steps[:] = 0
+
+    def step(self):
+        i = np.flatnonzero(~self.halted)
+        if len(i) == 0:
+            return
+        M = self.memory
+        pc = self.program_counter[i]
+        first = M[i, pc].astype(np.int64)
+        second = M[i, (pc+1)&0xffff].astype(np.int64)
+        third = M[i, (pc+2)&0xffff].astype(np.int64)
+        self.program_counter[i] = (pc+self.lengths[first])&0xffff
+        self.steps[i] += 1
+        ins = first>>3
+        for op in np.unique(ins):
+            selected = ins == op
+            self.functions[op](i[selected], first[selected], second[selected], third[selected])
+        pending = i[(self.interrupt[i] == 1) & (self.interrupt_enable[i] == 1)]
+        if len(pending):
+            self.enter_interrupt(pending)
+
+    def run(self, max_steps):
+        for _ in range(max_steps):
+            if self.halted.all():
+                break
+            self.step()
+
+    def push(self, i, value):
+        R = self.registers
+        self.memory[i, 0xff00+R[i, 0xf].astype(np.int64)] = value
+        R[i, 0xf] += 1
+
+    def pull(self, i):
+        R = self.registers
+        R[i, 0xf] -= 1
+        return self.memory[i, 0xff00+R[i, 0xf].astype(np.int64)].astype(np.int64)
+
+    def enter_interrupt(self, i):
+        F = (self.zero[i]<<1)|self.carry[i]
+        PC = self.program_counter[i]
+        self.push(i, (PC&0xff00)>>8)
+        self.push(i, PC&0x00ff)
+        self.push(i, F)
+        M = self.memory
+        self.program_counter[i] = (M[i, 0x7ffe].astype(np.int64)<<8)|M[i, 0x7fff]
+        self.interrupt_enable[i] = 0
+
+    def set_interrupt(self, which):
+        i = np.arange(self.count)[which]
+        i = i[self.interrupt_enable[i] == 1]
+        self.interrupt[i] = 1
+
+    def emulator(self, k):
+        emu = Emulator()
+        emu.program_counter = int(self.program_counter[k])
+        emu.registers = array("B", self.registers[k].tobytes())
+        emu.memory = array("B", self.memory[k].tobytes())
+        emu.carry = int(self.carry[k])
+        emu.zero = int(self.zero[k])
+        emu.interrupt = int(self.interrupt[k])
+        emu.interrupt_enable = int(self.interrupt_enable[k])
+        emu.halted = bool(self.halted[k])
+        return emu
+
+    def read(self, i, A):
+        return self.registers[i, A].astype(np.int64)
+
+    def write(self, i, A, value):
+        self.registers[i, A] = value&0xff
+        self.zero[i] = self.registers[i, A] == 0
+
+    def add(self, i, first, second, third):
+        A = second>>4
+        result = self.read(i, A)+self.read(i, second&0xf)
+        self.carry[i] = result >= 256
+        self.write(i, A, result)
+
+    def sub(self, i, first, second, third):
+        A = second>>4
+        result = self.read(i, A)-self.read(i, second&0xf)
+        self.carry[i] = result < 0
+        self.write(i, A, result)
+
+    def mul(self, i, first, second, third):
+        A = second>>4
+        B = second&0xf
+        R = self.registers
+        result = self.read(i, A)*self.read(i, B)
+        R[i, A] = (result&0xff00)>>8
+        R[i, B] = result&0x00ff
+        self.carry[i] = R[i, A] > 0
+        self.zero[i] = R[i, B] == 0
+
+    def div(self, i, first, second, third):
+        A = second>>4
+        B = second&0xf
+        R = self.registers
+        divisor = self.read(i, B)
+        zero = divisor == 0
+        self.fault(i[zero])
+        i, A, B, divisor = i[~zero], A[~zero], B[~zero], divisor[~zero]
+        dividend = self.read(i, A)
+        R[i, A] = dividend//divisor
+        R[i, B] = dividend%divisor
+        self.carry[i] = R[i, A] > 0
+        self.zero[i] = R[i, B] == 0
+
+    def shl(self, i, first, second, third):
+        A = second>>4
+        value = self.read(i, A)
+        self.carry[i] = (value&0b10000000)>>7
+        self.write(i, A, value<<(second&0b111))
+
+    def shr(self, i, first, second, third):
+        A = second>>4
+        value = self.read(i, A)
+        self.carry[i] = value&0b00000001
+        self.write(i, A, value>>(second&0b111))
+
+    def and_(self, i, first, second, third):
+        A = second>>4
+        self.write(i, A, self.read(i, A)&self.read(i, second&0xf))
+
+    def orr(self, i, first, second, third):
+        A = second>>4
+        self.write(i, A, self.read(i, A)|self.read(i, second&0xf))
+
+    def xor(self, i, first, second, third):
+        A = second>>4
+        self.write(i, A, self.read(i, A)^self.read(i, second&0xf))
+
+    def not_(self, i, first, second, third):
+        A = second>>4
+        self.write(i, A, ~self.read(i, A))
+
+    def psh(self, i, first, second, third):
+        self.push(i, self.read(i, second>>4))
+
+    def pop(self, i, first, second, third):
+        value = self.pull(i)
+        self.registers[i, second>>4] = value
+
+    def cal(self, i, first, second, third):
+        PC = self.program_counter[i]
+        self.push(i, (PC&0xff00)>>8)
+        self.push(i, PC&0x00ff)
+        self.program_counter[i] = (second<<8)|third
+
+    def ret(self, i, first, second, third):
+        low = self.pull(i)
+        high = self.pull(i)
+        self.program_counter[i] = (high<<8)|low
+
+    def jmp(self, i, first, second, third):
+        self.program_counter[i] = (second<<8)|third
+
+    def jif(self, i, first, second, third):
+        zcs = first&0b00000111
+        zero = self.zero[i]
+        taken = (
+            ((zcs == 0b101) | (zcs == 0b011)) & (zero == 1) |
+            ((zcs == 0b100) | (zcs == 0b010)) & (zero == 0)
+        )
+        self.program_counter[i[taken]] = ((second<<8)|third)[taken]
+
+    def lod(self, i, first, second, third):
+        addr = (((second<<8)|third)+self.read(i, 0xe))%65536
+        self.write(i, first&0b00001111, self.memory[i, addr])
+
+    def ldi(self, i, first, second, third):
+        self.write(i, first&0b00001111, second)
+
+    def sto(self, i, first, second, third):
+        A = first&0b00001111
+        addr = (((second<<8)|third)+self.read(i, 0xe))%65536
+        self.memory[i, addr] = self.registers[i, A]
+        self.zero[i] = self.registers[i, A] == 0
+
+    def inc(self, i, first, second, third):
+        A = second>>4
+        result = self.read(i, A)+1
+        self.carry[i] = result >= 256
+        self.write(i, A, result)
+
+    def dec(self, i, first, second, third):
+        A = second>>4
+        result = self.read(i, A)-1
+        self.carry[i] = result < 0
+        self.write(i, A, result)
+
+    def cmp(self, i, first, second, third):
+        result = self.read(i, second>>4)-self.read(i, second&0xf)
+        self.carry[i] = result < 0
+        self.zero[i] = (result&0xff) == 0
+
+    def nop(self, i, first, second, third):
+        pass
+
+    def hlt(self, i, first, second, third):
+        self.halted[i] = True
+
+    def mov(self, i, first, second, third):
+        self.registers[i, second&0xf] = self.registers[i, second>>4]
+
+    def rti(self, i, first, second, third):
+        F = self.pull(i)
+        self.zero[i] = (F&0b00000010)>>1
+        self.carry[i] = F&0b00000001
+        low = self.pull(i)
+        high = self.pull(i)
+        self.program_counter[i] = (high<<8)|low
+        self.interrupt[i] = 0
+        self.interrupt_enable[i] = 1
+
+    def sei(self, i, first, second, third):
+        self.interrupt_enable[i] = 1
+
+    def cli(self, i, first, second, third):
+        self.interrupt_enable[i] = 0
+
+    def illegal(self, i, first, second, third):
+        self.fault(i)
+
+    def fault(self, i):
+        self.faulted[i] = True
+        self.halted[i] = True
@@ -0,0 +1,291 @@
+from emulator import Emulator
+from translator import BlockEmulator
+from devices import Timer
+from cmc import compile
+from concurrent.futures import ProcessPoolExecutor
+from json import dump, load
+from platform import python_version
+from sys import argv, stderr
+from time import perf_counter, time
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:
+    getrusage = None
+
+workloads = {
+"mixed": """
+ldi r0 0
+ldi r1 1
+.loop
+add r0 r1
+psh r0
+pop r2
+lod r3 data
+sto r0 data
+cmp r0 r1
+jif z 0 loop
+jmp loop
+.data
+put 0
+""",
+"arith": """
+ldi r0 0
+ldi r1 3
+ldi r2 1
+.loop
+add r0 r1
+sub r0 r2
+xor r3 r0
+and r3 r1
+orr r4 r3
+shl r4 1
+shr r4 2
+not r5
+inc r6
+dec r7
+cmp r6 r7
+mov r0 r8
+jmp loop
+""",
+"memcpy": """
+.start
+ldi re 0
+.copy
+lod r0 1000x
+sto r0 2000x
+inc re
+jif z 0 copy
+jmp start
+""",
+"recursion": """
+.start
+ldi r0 20x
+cal down
+jmp start
+.down
+dec r0
+jif z 1 bottom
+cal down
+.bottom
+ret
+""",
+"muldiv": """
+.loop
+ldi r0 d3x
+ldi r1 17
+mul r0 r1
+ldi r2 fex
+ldi r3 7
+div r2 r3
+ldi r4 250
+ldi r5 13
+div r4 r5
+mul r4 r5
+jmp loop
+""",
+"interrupts": """
+ldi r0 0
+ldi r1 10x
+sto r0 8010x
+sto r1 8011x
+ldi r2 3
+sto r2 8012x
+sei
+.main
+inc r3
+jmp main
+.handler
+psh r0
+lod r0 count
+inc r0
+sto r0 count
+pop r0
+rti
+.count
+put 0
+go 7ffex
+put handler
+""",
+}
+
+engines = {
+    "run": Emulator,
+    "block": BlockEmulator,
+}
+
+def help():
+    print("""
+Usage:
+    benchmark [OPTIONS] [workload...]
+
+Options:
+    -s <steps>  Instructions per measurement.
+                (default 1000000)
+    -r <count>  Measurements per workload, the
+                best one is kept. (default 3)
+    -e <names>  Comma separated engines.
+                (default run,block)
+    -a <lines>  Also time assembling a synthetic
+                source of this many lines.
+    -o <name>   Save the results as JSON.
+    -c <name>   Compare with saved results.
+""")
+
+def peak_rss():
+    if getrusage is None:
+        return None
+    # kilobytes on linux
+    return getrusage(RUSAGE_SELF).ru_maxrss*1024
+
+def measure(workload, engine, steps):
+    program = compile({workload: workloads[workload]})
+    emu = engines[engine]()
+    emu.attach(Timer(0x8010))
+    emu.load(program)
+    start = perf_counter()
+    reason, done = emu.run(max_steps=steps)
+    wall_time = perf_counter()-start
+    return {
+        "workload": workload,
+        "engine": engine,
+        "steps": done,
+        "halt_reason": reason,
+        "wall_time": wall_time,
+        "steps_per_sec": done/wall_time,
+        "peak_rss": peak_rss(),
+    }
+
+# a mix of every instruction format; references go to labels near the
+# start, since the source grows past the 64 KiB address space
+def synthetic(lines):
+    chunk = [
+        ".s{0}",
+        "ldi r1 {1}",
+        "ldi r2 10x",
+        "add r1 r2",
+        "mul r1 r2",
+        "shl r3 2",
+        "not r4",
+        "psh r1",
+        "pop r5",
+        "lod r6 data+{1}",
+        "sto r6 2000x",
+        "cmp r1 r2",
+        "jif z 1 s0",
+        "cal data",
+        "jmp s0",
+        "put 1 2x 11b \"a\"",
+        "ret",
+    ]
+    source = ["jmp s0", ".data", "go 200x"]
+    for i in range(0, lines, len(chunk)):
+        source += [line.format(i, i%256) for line in chunk]
+    return "\n".join(source[:lines])
+
+def measure_assembler(lines):
+    source = synthetic(lines)
+    start = perf_counter()
+    image = compile({"synthetic": source})
+    wall_time = perf_counter()-start
+    return {
+        "lines": lines,
+        "bytes": len(image),
+        "wall_time": wall_time,
+        "lines_per_sec": lines/wall_time,
+        "peak_rss": peak_rss(),
+    }
+
+def run_suite(names, engine_names, steps, repeat):
+    results = []
+    # each measurement gets a fresh process, so peak RSS is its own
+    with ProcessPoolExecutor(1, max_tasks_per_child=1) as executor:
+        for name in names:
+            for engine in engine_names:
+                runs = [executor.submit(measure, name, engine, steps).result() for _ in range(repeat)]
+                results.append(min(runs, key=lambda result: result["wall_time"]))
+    return results
+
+def main():
+    steps = 1000000
+    repeat = 3
+    engine_names = list(engines)
+    lines = 0
+    output = None
+    baseline = None
+    args = argv[1:]
+    if "-h" in args or "--help" in args:
+        help()
+        return
+    for option in ["-s", "-r", "-e", "-a", "-o", "-c"]:
+        if option in args:
+            index = args.index(option)
+            if index+1 >= len(args):
+                print(f"Error: No value given after {option}", file=stderr)
+                exit(1)
+            value = args.pop(index+1)
+            args.pop(index)
+            if option == "-e":
+                engine_names = value.split(",")
+            elif option == "-o":
+                output = value
+            elif option == "-c":
+                baseline = value
+            elif not value.isdigit():
+                print(f"Error: {option} takes a number, got: {value}", file=stderr)
+                exit(1)
+            elif option == "-s":
+                steps = int(value)
+            elif option == "-a":
+                lines = int(value)
+            else:
+                repeat = max(1, int(value))
+    names = args or list(workloads)
+    for name in names:
+        if name not in workloads:
+            print(f"Error: Unknown workload: {name}", file=stderr)
+            exit(1)
+    for engine in engine_names:
+        if engine not in engines:
+            print(f"Error: Unknown engine: {engine}", file=stderr)
+            exit(1)
+    previous = {}
+    previous_assembler = None
+    if baseline:
+        with open(baseline) as file:
+            saved = load(file)
+        for result in saved["results"]:
+            previous[result["workload"], result["engine"]] = result
+        previous_assembler = saved.get("assembler")
+    results = run_suite(names, engine_names, steps, repeat)
+    print("workload    engine      steps/sec   wall time   peak RSS")
+    for result in results:
+        rss = result["peak_rss"]
+        line = f"{result['workload']:<12}{result['engine']:<8}{result['steps_per_sec']:>13,.0f}{result['wall_time']:>11.3f}s"
+        line += f"{rss/2**20:>9.1f}MB" if rss is not None else "        -"
+        old = previous.get((result["workload"], result["engine"]))
+        if old is not None:
+            line += f"  {100*(result['steps_per_sec']/old['steps_per_sec']-1):+.1f}%"
+        print(line)
+    assembler = None
+    if lines:
+        with ProcessPoolExecutor(1, max_tasks_per_child=1) as executor:
+            runs = [executor.submit(measure_assembler, lines).result() for _ in range(repeat)]
+        assembler = min(runs, key=lambda result: result["wall_time"])
+        line = f"\nassembler: {lines} lines in {assembler['wall_time']:.3f}s ({assembler['lines_per_sec']:,.0f} lines/sec)"
+        if previous_assembler is not None and previous_assembler["lines"] == lines:
+            line += f"  {100*(assembler['lines_per_sec']/previous_assembler['lines_per_sec']-1):+.1f}%"
+        print(line)
+    if output:
+        with open(output, "w") as file:
+            dump({
+                "time": time(),
+                "python": python_version(),
+                "steps": steps,
+                "repeat": repeat,
+                "results": results,
+                "assembler": assembler,
+            }, file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,11 @@
+from image import pack_segments
+from symbols import Symbols
 from sys import argv, stderr
-from array import array
+from hashlib import sha256
+from os import path, makedirs, replace, cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import pickle
 
 table = {
   "add": "00000",
@@ -32,6 +38,17 @@ table = {
   "cli": "11110",
 }
 
+# the first byte of each instruction with its operand bits cleared
+opcodes = {
+    instruction: int(bits, 2)<<(8-len(bits))
+    for instruction, bits in table.items()
+}
+
+labels = {}
+
+class AsmError(Exception):
+    pass
+
 def error(msg, code=1):
     print("Error:", msg, file=stderr)
     if code > 0:
@@ -45,6 +62,20 @@ Usage:
 Options:
     -o <name>   Give a name to the
                 output file.
+    -c <dir>    Keep assembled files in this
+                directory and reuse them while
+                their source is unchanged.
+    -j <count>  Processes to assemble files
+                with. (default: one per CPU)
+    -s          Save only the address ranges
+                that hold code or data instead
+                of an image padded with zeros.
+    -m          Also save the address of each
+                line and label as <name>.map.
+    -O          Rewrite redundant instruction
+                sequences: psh/pop pairs, mov
+                back and forth, jmp to the next
+                line and chains of inc.
 """)
 
 def get_input(files):
@@ -67,19 +98,16 @@ def error_line(msg, code=1):
     print(f"{index+1}".rjust(len(indexstr))+" | ...", file=stderr)
     exit(code)
 
-def is_register(element):
-    return (
-        len(element) == 2 and
-        element[0].lower() == "r" and
-        element[1].lower() in "0123456789abcdef"
-    )
+registers = {
+    r+c: int(c, 16)
+    for r in "rR" for c in "0123456789abcdefABCDEF"
+}
 
 def get_register(element):
-    if is_register(element):
-        reg_index = int(element[1], 16)
-        return reg_index
+    if element in registers:
+        return registers[element]
     else:
-        error_line(f"Register expected, got: {element}")
+        raise AsmError(f"Register expected, got: {element}")
 
 def is_hex(element):
     if is_negative(element):
@@ -115,8 +143,12 @@ def is_dec(element):
 def is_negative(element):
     return len(element) > 1 and element[0] == "-"
 
+# the same numbers come up over and over in a source, so parsed ones
+# are kept
+numbers = {}
+
 def is_number(element):
-    return (
+    return element in numbers or (
         is_hex(element) or
         is_bin(element) or
         is_dec(element) or
@@ -127,6 +159,8 @@ def is_number(element):
     )
 
 def get_number(element):
+    if element in numbers:
+        return numbers[element]
     if is_hex(element):
         number = element[:-1]
         base = 16
@@ -139,11 +173,13 @@ def get_number(element):
     elif is_string(element):
         string = get_string(element)
         if len(string) != 1:
-            error_line(f"String length must be 1")
+            raise AsmError(f"String length must be 1")
+        numbers[element] = ord(string)
         return ord(string)
     else:
-        error_line(f"Number expected, got: {element}")
-    return int(number, base)
+        raise AsmError(f"Number expected, got: {element}")
+    numbers[element] = int(number, base)
+    return numbers[element]
 
 def is_label(element):
     return element in labels
@@ -156,7 +192,7 @@ def get_address(element):
         if sign in element:
             index = element.index(sign)
             if index == 0 or index == len(element)-1:
-                error_line(f"Invalid use of '{sign}' in address: {element}")
+                raise AsmError(f"Invalid use of '{sign}' in address: {element}")
             symbol = element[:index]
             rest = element[index+1:]
             if is_label(symbol):
@@ -171,7 +207,7 @@ def get_address(element):
         elif is_label(element):
             return get_label(element)
         else:
-            error_line(f"Invalid address: {element}")
+            raise AsmError(f"Invalid address: {element}")
 
 def is_string(element):
     return element[0] == element[-1] and element[0] == '"' and '"' not in element[1:-1]
@@ -179,207 +215,694 @@ def is_string(element):
 def get_string(element):
     return element[1:-1]
 
-def compile(codes):
-    global labels, file_name, line_number, line
-    bytelist = array("B", [])
+# packs (value, width) fields into bytes like a string of bits would be:
+# a field wider than its width keeps all its bits and a trailing chunk
+# shorter than 8 bits becomes a byte of its own
+def pack(fields):
+    data = bytearray()
+    acc = 0
+    bits = 0
+    for value, width in fields:
+        width = max(width, value.bit_length())
+        acc = (acc<<width)|value
+        bits += width
+        while bits >= 8:
+            bits -= 8
+            data.append(acc>>bits)
+            acc &= (1<<bits)-1
+    if bits:
+        data.append(acc)
+    return data
+
+# sizes as counted when laying out labels; an unknown instruction takes
+# no space and is only reported when it is encoded
+sizes = {}
+for instruction in ["jmp","cal","jif","lod","sto"]:
+    sizes[instruction] = 3
+for instruction in [
+    "add","sub","mul","div",
+    "and","orr","xor","cmp","mov",
+    "shl","shr","not",
+    "psh","pop","inc","dec","ldi"
+]:
+    sizes[instruction] = 2
+for instruction in ["ret","nop","hlt","rti","sei","cli"]:
+    sizes[instruction] = 1
+
+# an address made of numbers only is resolved when parsing, any other
+# address is kept as text and resolved once all labels are known
+def is_constant(element):
+    for sign in "+-":
+        if sign in element:
+            index = element.index(sign)
+            if index == 0 or index == len(element)-1:
+                return True
+            return is_number(element[:index]) and is_constant(element[index+1:])
+    return is_number(element)
+
+def parse_address(element, limit="65535"):
+    if not is_constant(element):
+        return element
+    addr = get_address(element)
+    if addr<0 or 65535<addr:
+        raise AsmError(f"'{addr}' is not in the range [0, {limit}]")
+    return addr
+
+def parse_operands(instruction, elements):
+    if instruction in [
+        "jmp","cal"
+    ]:
+        if len(elements) != 1:
+            raise AsmError(f"'{instruction}' takes 1 arguments, {len(elements)} given.")
+        return (parse_address(elements[0]),)
+    elif instruction in [
+        "jif"
+    ]:
+        if len(elements) != 3:
+            raise AsmError(f"'{instruction}' takes 3 arguments, {len(elements)} given.")
+        element = elements[0]
+        if len(element) == 1 and \
+        element.lower() in "zc":
+            flag = 0b100 if element.lower() == "z" else 0b010
+        else:
+            raise AsmError(f"'Z or C expected, {element} given.")
+        element = elements[1]
+        if len(element) == 1 and \
+        element.lower() in "01":
+            set_ = int(element)
+        else:
+            raise AsmError(f"'Z or C expected, {element} given.")
+        return flag|set_, parse_address(elements[2], "255")
+    elif instruction in [
+        "ldi"
+    ]:
+        if len(elements) != 2:
+            raise AsmError(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
+        reg_index = get_register(elements[0])
+        imm = get_number(elements[1])
+        if imm<0 or 256<=imm:
+            raise AsmError(f"'{imm}' is not in the range [0, 255]")
+        return reg_index, imm
+    elif instruction in [
+        "lod","sto"
+    ]:
+        if len(elements) != 2:
+            raise AsmError(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
+        reg_index = get_register(elements[0])
+        return reg_index, parse_address(elements[1])
+    elif instruction in [
+        "add","sub","mul","div",
+        "and","orr","xor","cmp","mov"
+    ]:
+        if len(elements) != 2:
+            raise AsmError(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
+        return get_register(elements[0]), get_register(elements[1])
+    elif instruction in [
+        "not","psh","pop","inc","dec"
+    ]:
+        if len(elements) != 1:
+            raise AsmError(f"'{instruction}' takes 1 arguments, {len(elements)} given.")
+        return (get_register(elements[0]),)
+    elif instruction in [
+        "shl","shr"
+    ]:
+        if len(elements) != 2:
+            raise AsmError(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
+        reg_index = get_register(elements[0])
+        value = get_number(elements[1])
+        if value<1 or value>8:
+            raise AsmError("Second argument must be in range [1, 8]")
+        return reg_index, value
+    elif instruction in [
+        "ret","nop","hlt","rti","sei","cli"
+    ]:
+        if len(elements) != 0:
+            raise AsmError(f"'{instruction}' takes no arguments, {len(elements)} given.")
+        return ()
+    raise AsmError("Unknown instruction.")
+
+def put_data(rest, elements):
+    if is_string(rest):
+        string = get_string(rest)
+        if all(ord(c) < 256 for c in string):
+            return string.encode("latin-1")
+        return bytes(pack([(ord(c), 8) for c in string]))
+    data = bytearray()
+    for element in elements:
+        byte = get_number(element)
+        if byte<0 or 256<=byte:
+            raise AsmError(f"'{byte}' is not in the range [0, 255]")
+        data.append(byte)
+    return bytes(data)
+
+# the item of a source line: (op, operands, size, line number, line),
+# or None for an empty line. op is the lowercase instruction, "." for a
+# label, "put", "go" or "error" for a line that cannot be encoded, whose
+# message is its operand
+def parse_line(line_number, line):
+    line = line.split(";")[0].strip()
+    if len(line) == 0:
+        return None
+    if line[0] == ".":
+        return ".", line[1:], 0, line_number, line
+    elements = line.split()
+    instruction = elements.pop(0).lower()
+    if instruction == "put":
+        rest = line[4:]
+        if is_string(rest):
+            size = len(get_string(rest))
+        else:
+            size = sum(1 if is_number(element) else 2 for element in elements)
+        try:
+            operands = rest, put_data(rest, elements), None
+        except AsmError as error:
+            operands = rest, None, str(error)
+        return "put", operands, size, line_number, line
+    if instruction == "go":
+        return "go", elements[0] if len(elements) == 1 else None, 0, line_number, line
+    size = sizes.get(instruction, 0)
+    try:
+        return instruction, parse_operands(instruction, elements), size, line_number, line
+    except AsmError as error:
+        return "error", str(error), size, line_number, line
+
+def parse(code):
+    items = []
+    for line_number, line in enumerate(code.split("\n"), 1):
+        item = parse_line(line_number, line)
+        if item is not None:
+            items.append(item)
+    return items
+
+# the registers and flags an instruction reads and writes, as register
+# indices and "z", "c"; None for anything that may leave the straight
+# line, or is not an instruction
+def effects(op, operands):
+    if op in ["add","sub"]:
+        A, B = operands
+        return {A, B}, {A, "c", "z"}
+    if op in ["mul","div"]:
+        A, B = operands
+        return {A, B}, {A, B, "c", "z"}
+    if op in ["and","orr","xor"]:
+        A, B = operands
+        return {A, B}, {A, "z"}
+    if op == "cmp":
+        return set(operands), {"c", "z"}
+    if op == "mov":
+        A, B = operands
+        return {A}, {B}
+    if op == "not":
+        return {operands[0]}, {operands[0], "z"}
+    if op in ["inc","dec","shl","shr"]:
+        return {operands[0]}, {operands[0], "c", "z"}
+    if op == "psh":
+        return {operands[0], 0xf}, {0xf}
+    if op == "pop":
+        return {0xf}, {operands[0], 0xf}
+    if op == "ldi":
+        return set(), {operands[0], "z"}
+    if op == "lod":
+        return {0xe}, {operands[0], "z"}
+    if op == "sto":
+        return {operands[0], 0xe}, {"z"}
+    if op == "nop":
+        return set(), set()
+    return None
+
+# whether a register or flag is written before it is read from item i
+# on. Past a label, jump or the end of the file it may be read, so it is
+# taken to be in use
+def dead(items, i, name):
+    for op, operands, _, _, _ in items[i:]:
+        found = effects(op, operands)
+        if found is None or name in found[0]:
+            return False
+        if name in found[1]:
+            return True
+    return False
+
+# rewrites sequences that do the same in fewer instructions. Labels stay
+# items of their own, so they move with the code around them, and
+# nothing is rewritten across one
+def peephole(items):
+    out = []
+    for item in items:
+        op, operands = item[:2]
+        last = out[-1] if out else (None, None)
+        if op == "pop" and last[0] == "psh" and last[1] == operands:
+            # the value is pushed and popped straight back
+            out.pop()
+            continue
+        if op == "mov" and last[0] == "mov" and last[1] == operands[::-1]:
+            # copies the value back where it came from
+            continue
+        if op == ".":
+            i = len(out)
+            while i and out[i-1][0] == ".":
+                i -= 1
+            if i and out[i-1][0] == "jmp" and out[i-1][1][0] == operands:
+                # jumps to the label right after it
+                del out[i-1]
+        out.append(item)
+    items = out
+    out = []
+    i = 0
+    while i < len(items):
+        op, operands, size, line_number, line = items[i]
+        end = i
+        while end < len(items) and items[end][:2] == ("inc", operands):
+            end += 1
+        # n times inc as ldi and add, which leaves the same zero flag but
+        # not the same carry if it wraps, and needs a register to spare
+        if end-i >= 3 and end-i < 256 and dead(items, end, "c"):
+            A = operands[0]
+            for T in range(0xf):
+                if T != A and dead(items, end, T):
+                    out.append(("ldi", (T, end-i), 2, line_number, line))
+                    out.append(("add", (A, T), 2, items[i+1][3], items[i+1][4]))
+                    i = end
+                    break
+            else:
+                out.append(items[i])
+                i += 1
+            continue
+        out.append(items[i])
+        i += 1
+    return out
+
+# with no limit, as for 'put <label>', the address is not range checked
+def resolve(element, limit="65535"):
+    try:
+        addr = get_address(element)
+    except AsmError as error:
+        error_line(str(error))
+    if limit is not None and (addr<0 or 65535<addr):
+        error_line(f"'{addr}' is not in the range [0, {limit}]")
+    return addr
+
+# writes the bytes of a line into data at pos, and its references to
+# labels to fixups unless final is set. data is sized from the layout and
+# written by index, growing only for the few lines that take more than
+# they were laid out with. Returns where the line ends, or None if it
+# cannot be encoded
+def encode(op, operands, data, pos, fixups, final=False):
+    if len(data) < pos+3:
+        data += bytes(pos+3-len(data))
+    if op in [
+        "jmp","cal","jif","lod","sto"
+    ]:
+        first, addr = operands if len(operands) == 2 else (0, operands[0])
+        if type(addr) is str:
+            if final:
+                addr = resolve(addr, "255" if op == "jif" else "65535")
+            else:
+                fixups.append((pos+1, op, addr, line_number, line))
+                addr = 0
+        data[pos] = opcodes[op]|first
+        data[pos+1] = addr>>8
+        data[pos+2] = addr&0xff
+        return pos+3
+    elif op == "ldi":
+        data[pos] = opcodes[op]|operands[0]
+        data[pos+1] = operands[1]
+        return pos+2
+    elif op in [
+        "add","sub","mul","div",
+        "and","orr","xor","cmp","mov"
+    ]:
+        data[pos] = opcodes[op]
+        data[pos+1] = (operands[0]<<4)|operands[1]
+        return pos+2
+    elif op in [
+        "not","psh","pop","inc","dec"
+    ]:
+        data[pos] = opcodes[op]
+        data[pos+1] = operands[0]<<4
+        return pos+2
+    elif op in [
+        "shl","shr"
+    ]:
+        reg_index, value = operands
+        data[pos] = opcodes[op]
+        if value < 8:
+            data[pos+1] = (reg_index<<4)|value
+            return pos+2
+        # 8 takes 4 bits where the format has 3, which pushes a
+        # last 0 bit into a byte of its own
+        data[pos+1] = (reg_index<<4)|0b0100
+        data[pos+2] = 0
+        return pos+3
+    elif op == "put":
+        rest, encoded, message = operands
+        if final and rest in labels:
+            addr = resolve(rest, None)
+            encoded = bytes([addr>>8, addr&0xff]) if addr < 65536 else bytes(pack([(addr, 16)]))
+        elif encoded is None:
+            if final:
+                error_line(message)
+            # unless it turns out to be a label
+            fixups.append((pos, op, operands, line_number, line))
+            encoded = bytes(2)
+        elif not final:
+            # a number or string that is also a label name
+            fixups.append((pos, "check", operands, line_number, line))
+        data[pos:pos+len(encoded)] = encoded
+        return pos+len(encoded)
+    elif op in [
+        "ret","nop","hlt","rti","sei","cli"
+    ]:
+        data[pos] = opcodes[op]
+        return pos+1
+    elif final:
+        error_line(operands)
+    return None
+
+# turns the parsed lines of one file into an object that does not
+# depend on where the file ends up. An object is a list of segments, a
+# new one starting at every 'go', and two optional errors:
+#   segment: [go, size, data, labels, fixups, sources]
+#     go      None for the first segment, else the address, or the
+#             (address, line number, line) to resolve when linking
+#     size    its laid out size, which label addresses follow
+#     data    its encoded bytes
+#     labels  (name, offset, line number, line)
+#     fixups  (offset, kind, address, line number, line) for bytes that
+#             refer to labels and are written as zeros
+#     sources (offset, length, line number) of the bytes of each line
+#   stop    (message, line number, line) of a layout error that ends it
+#   failed  (segment, message, line number, line) of the first line
+#           that cannot be encoded; it is reported only if linking finds
+#           no layout error up to the end
+# With final set, all labels are known and resolved in place instead.
+def assemble(name, items, final=False):
+    global file_name, line_number, line
+    file_name = name
+    # the laid out size of each segment, which its data is allocated with
+    layout = [0]
+    for item in items:
+        if item[0] == "go":
+            layout.append(0)
+        else:
+            layout[-1] += item[2]
+    segments = []
+    data = bytearray(layout[0])
+    pos = 0
+    defined = []
+    fixups = []
+    sources = []
+    segment = [None, 0, data, defined, fixups, sources]
+    segments.append(segment)
+    stop = None
+    failed = None
+    for op, operands, size, line_number, line in items:
+        if op == ".":
+            if final:
+                continue
+            if len(operands) == 0:
+                stop = "Label name cannot be empty.", line_number, line
+                break
+            defined.append((operands, segment[1], line_number, line))
+            continue
+        if op == "go":
+            if operands is None:
+                stop = f"Give an address after 'go' statement.", line_number, line
+                break
+            go = operands, line_number, line
+            if is_constant(operands):
+                try:
+                    go = parse_address(operands)
+                except AsmError as error:
+                    stop = str(error), line_number, line
+                    break
+            del data[pos:]
+            data = bytearray(layout[len(segments)])
+            pos = 0
+            defined = []
+            fixups = []
+            sources = []
+            segment = [go, 0, data, defined, fixups, sources]
+            segments.append(segment)
+            continue
+        segment[1] += size
+        if failed is not None:
+            continue
+        end = encode(op, operands, data, pos, fixups, final)
+        if end is None:
+            failed = len(segments)-1, operands, line_number, line
+        elif end > pos:
+            sources.append((pos, end-pos, line_number))
+            pos = end
+    del data[pos:]
+    return segments, stop, failed
+
+# places the objects one after another, defining their labels. Returns
+# the image, the fixups up to the first line that could not be encoded,
+# as (position, kind, address, file name, line number, line), and where
+# the bytes of each line went, as (position, length, file name, line
+# number) in order of position.
+def link(objects):
+    global file_name, line_number, line
+    out = bytearray(2**15)
+    pos = 0
     pc_addr = 0
+    fixups = []
+    failed = None
+    placed = []
+    for file_name, (segments, stop, failing) in objects.items():
+        for index, (go, size, data, defined, relocations, sources) in enumerate(segments):
+            if type(go) is tuple:
+                element, line_number, line = go
+                go = resolve(element)
+            if go is not None:
+                pc_addr = go
+                # going back does not move the output
+                pos = max(pos, go)
+            for name, offset, line_number, line in defined:
+                if name in labels:
+                    error_line(f"Redefinition of label: {name}")
+                labels[name] = pc_addr+offset
+            pc_addr += size
+            if failed is not None:
+                continue
+            if failing is not None and failing[0] == index:
+                _, message, line_number, line = failing
+                failed = message, file_name, line_number, line
+            if pos+len(data) > len(out):
+                out.extend(bytes(pos+len(data)))
+            out[pos:pos+len(data)] = data
+            for offset, length, line_number in sources:
+                placed.append((pos+offset, length, file_name, line_number))
+            for offset, kind, element, line_number, line in relocations:
+                fixups.append((pos+offset, kind, element, file_name, line_number, line))
+            pos += len(data)
+        if stop is not None:
+            message, line_number, line = stop
+            error_line(message)
+    if pos > len(out):
+        out.extend(bytes(pos-len(out)))
+    del out[max(pos, 2**15):]
+    return out, fixups, failed, placed
+
+# objects are cached under the hash of their source; the version is
+# part of the key, so a format change never loads an old object
+VERSION = b"cmc-object-2"
+
+def object_path(cache, code, optimize=False):
+    flags = b"-O" if optimize else b""
+    return path.join(cache, sha256(VERSION+flags+code.encode()).hexdigest())
+
+def read_object(object_name):
+    try:
+        with open(object_name, "rb") as file:
+            return pickle.load(file)
+    except (IOError, pickle.UnpicklingError, EOFError):
+        return None
+
+def write_object(object_name, assembled):
+    makedirs(path.dirname(object_name), exist_ok=True)
+    # written aside and renamed, so a reader never sees half an object
+    with open(object_name+".tmp", "wb") as file:
+        pickle.dump(assembled, file)
+    replace(object_name+".tmp", object_name)
+
+def parse_file(code, optimize=False):
+    items = parse(code)
+    return peephole(items) if optimize else items
+
+def assemble_file(name, code, optimize=False):
+    return assemble(name, parse_file(code, optimize))
+
+# below this many characters of source, starting processes takes longer
+# than assembling the files on one core
+PARALLEL = 200000
+
+# files are parsed and encoded on their own, errors included, so they
+# can be spread over processes; labels are only needed when linking
+def assemble_files(codes, jobs=None, optimize=False):
+    if jobs is None:
+        jobs = cpu_count() or 1
+    if jobs > 1 and len(codes) > 1 and sum(map(len, codes.values())) >= PARALLEL:
+        with ProcessPoolExecutor(min(jobs, len(codes))) as executor:
+            return list(executor.map(assemble_file, codes, codes.values(), repeat(optimize)))
+    return list(map(assemble_file, codes, codes.values(), repeat(optimize)))
+
+# returns the image and where the bytes of each line went
+def build(codes, cache=None, jobs=None, optimize=False):
+    global labels, file_name, line_number, line
+    labels = {}
+    objects = dict.fromkeys(codes)
+    if cache is not None:
+        for name, code in codes.items():
+            objects[name] = read_object(object_path(cache, code, optimize))
+    missing = {name: codes[name] for name in objects if objects[name] is None}
+    for name, assembled in zip(missing, assemble_files(missing, jobs, optimize)):
+        objects[name] = assembled
+        if cache is not None:
+            write_object(object_path(cache, codes[name], optimize), assembled)
+    out, fixups, failed, placed = link(objects)
+    for pos, kind, element, file_name, line_number, line in fixups:
+        if kind == "check":
+            if element[0] in labels:
+                break
+        elif kind == "put":
+            rest, _, message = element
+            if rest not in labels:
+                error_line(message)
+            addr = resolve(rest, None)
+            if addr > 65535:
+                break
+            out[pos] = addr>>8
+            out[pos+1] = addr&0xff
+        else:
+            addr = resolve(element, "255" if kind == "jif" else "65535")
+            out[pos] = addr>>8
+            out[pos+1] = addr&0xff
+    else:
+        if failed is not None:
+            message, file_name, line_number, line = failed
+            error_line(message)
+        return out, placed
+    # a label used where the fixups cannot express it, so the files are
+    # encoded again with all labels known
+    objects = {name: assemble(name, parse_file(code, optimize), True) for name, code in codes.items()}
+    out, _, _, placed = link(objects)
+    return out, placed
+
+def compile(codes, cache=None, jobs=None, optimize=False):
+    out, _ = build(codes, cache, jobs, optimize)
+    return bytes(out)
+
+# the ranges of the image that hold code or data, as (base, bytes)
+def segments(out, placed):
+    ranges = []
+    for pos, length, _, _ in placed:
+        if ranges and ranges[-1][1] == pos:
+            ranges[-1][1] += length
+        else:
+            ranges.append([pos, pos+length])
+    return [(start, bytes(out[start:end])) for start, end in ranges]
+
+def symbol_table(placed):
+    files = {}
+    lines = []
+    for pos, length, name, number in placed:
+        lines.append((pos, length, files.setdefault(name, len(files)), number))
+    return Symbols(files, lines, [(addr, name) for name, addr in labels.items()])
+
+# only the code and data, instead of an image padded with zeros
+def compile_segments(codes, cache=None, jobs=None, optimize=False):
+    return segments(*build(codes, cache, jobs, optimize))
+
+# assembles source lines as they come, for {file name: lines} where the
+# lines can be any iterable, yielding (address, bytes) chunks in order.
+# References to labels are written as zeros and patched by chunks of
+# their own at the end, so neither the sources nor the image are held
+# whole. Written in order onto zeroed memory, the chunks give the image
+# compile() returns, except that a number or string put before it is
+# defined as a label is reported, as the label would change the layout
+# of what was already yielded.
+def stream(files, size=4096):
+    global labels, file_name, line_number, line
     labels = {}
-    for file_name, code in codes.items():
-        lines = [line for line in code.split("\n")]
-        for line_number, line in enumerate(lines, 1):
-            line = line.strip()
-            if len(line) == 0: continue
-            if line[0] == ".":
-                if len(line) == 1:
+    pc_addr = 0
+    base = 0
+    data = bytearray(size+3)
+    pos = 0
+    fixups = []
+    pending = []
+    failed = None
+    for file_name, lines in files.items():
+        for number, text in enumerate(lines, 1):
+            item = parse_line(number, text)
+            if item is None:
+                continue
+            op, operands, item_size, line_number, line = item
+            if op == ".":
+                if len(operands) == 0:
                     error_line("Label name cannot be empty.")
-                label = line[1:]
-                if label in labels:
-                    error_line(f"Redefinition of label: {label}")
-                labels[label] = pc_addr
-            else:
-                elements = line.split()
-                instruction = elements.pop(0).lower()
-                if instruction == "put":
-                    if is_string(line[4:]):
-                        string = get_string(line[4:])
-                        pc_addr += len(string)
-                    else:
-                        for element in elements:
-                            if is_number(element):
-                                pc_addr += 1
-                            else:
-                                pc_addr += 2
-                elif instruction == "go":
-                    if len(elements) != 1:
-                        error_line(f"Give an address after 'go' statement.")
-                    addr = get_address(elements[0])
-                    if addr<0 or 65535<addr:
-                        error_line(f"'{addr}' is not in the range [0, 65535]")
-                    pc_addr = addr
-                elif instruction in [
-                    "jmp","cal","jif","lod","sto"
-                ]:
-                    pc_addr += 3
-                elif instruction in [
-                    "add","sub","mul","div",
-                    "and","orr","xor","cmp","mov",
-                    "shl","shr","not",
-                    "psh","pop","inc","dec","ldi"
-                ]:
-                    pc_addr += 2
-                elif instruction in [
-                    "ret","nop","hlt","rti","sei","cli"
-                ]:
-                    pc_addr += 1
-    for file_name, code in codes.items():
-        lines = [line for line in code.split("\n")]
-        for line_number, line in enumerate(lines, 1):
-            line = line.strip()
-            if len(line) == 0: continue
-            if line[0] == ".":
-                pass
+                if operands in labels:
+                    error_line(f"Redefinition of label: {operands}")
+                labels[operands] = pc_addr
+                continue
+            if op == "go":
+                if operands is None:
+                    error_line(f"Give an address after 'go' statement.")
+                pc_addr = resolve(operands)
+                # going back does not move the output
+                if pc_addr > base+pos:
+                    if pos:
+                        yield base, bytes(data[:pos])
+                    base = pc_addr
+                    pos = 0
+                continue
+            pc_addr += item_size
+            if failed is not None:
+                continue
+            # a put of a label defined above is encoded as it is final
+            final = op == "put" and operands[0] in labels
+            end = encode(op, operands, data, pos, fixups, final)
+            if end is None:
+                failed = operands, file_name, line_number, line
             else:
-                bitstring = ""
-                elements = line.split()
-                instruction = elements.pop(0).lower()
-                if instruction in table:
-                    bitstring += table[instruction]
-                elif instruction == "put":
-                    if is_label(line[4:]):
-                        addr = get_address(line[4:])
-                        bitstring += bin(addr)[2:].zfill(16)
-                    elif is_string(line[4:]):
-                        string = get_string(line[4:])
-                        for c in string:
-                            byte = ord(c)
-                            bitstring += bin(byte)[2:].zfill(8)
-                    else:
-                        for element in elements:
-                            byte = get_number(element)
-                            if byte<0 or 256<=byte:
-                                error_line(f"'{byte}' is not in the range [0, 255]")
-                            bitstring += bin(byte)[2:].zfill(8)
-                elif instruction == "go":
-                    addr = get_address(elements[0])
-                    if addr<0 or 65535<addr:
-                        error_line(f"'{addr}' is not in the range [0, 65535]")
-                    while len(bitstring) > 0:
-                        byte = int(bitstring[:8], 2)
-                        bitstring = bitstring[8:]
-                        bytelist.append(byte)
-
-                    while len(bytelist) < addr:
-                        bytelist.append(0)
-                else:
-                    error_line("Unknown instruction.")
-                if instruction in [
-                    "jmp","cal"
-                ]:
-                    bitstring += "000"
-                    if len(elements) != 1:
-                        error_line(f"'{instruction}' takes 1 arguments, {len(elements)} given.")
-                    element = elements[0]
-                    addr = get_address(element)
-                    if addr<0 or 65535<addr:
-                        error_line(f"'{addr}' is not in the range [0, 65535]")
-                    bitstring += bin(addr)[2:].zfill(16)
-                elif instruction in [
-                    "jif"
-                ]:
-                    if len(elements) != 3:
-                        error_line(f"'{instruction}' takes 3 arguments, {len(elements)} given.")
-                    element = elements[0]
-                    if len(element) == 1 and \
-                    element.lower() in "zc":
-                        flag = element.lower()
-                    else:
-                        error_line(f"'Z or C expected, {element} given.")
-                    element = elements[1]
-                    if len(element) == 1 and \
-                    element.lower() in "01":
-                        set_ = element
-                    else:
-                        error_line(f"'Z or C expected, {element} given.")
-                    if flag == "z":
-                        bitstring += "10"
-                    if flag == "c":
-                        bitstring += "01"
-                    bitstring += set_
-                    element = elements[2]
-                    addr = get_address(element)
-                    if addr<0 or 65535<addr:
-                        error_line(f"'{addr}' is not in the range [0, 255]")
-                    bitstring += bin(addr)[2:].zfill(16)
-                elif instruction in [
-                    "ldi"
-                ]:
-                    if len(elements) != 2:
-                        error_line(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
-                    element = elements[0]
-                    reg_index = get_register(element)
-                    bitstring += bin(reg_index)[2:].zfill(4)
-                    element = elements[1]
-                    imm = get_number(element)
-                    if imm<0 or 256<=imm:
-                        error_line(f"'{imm}' is not in the range [0, 255]")
-                    bitstring += bin(imm)[2:].zfill(8)
-                elif instruction in [
-                    "lod","sto"
-                ]:
-                    if len(elements) != 2:
-                        error_line(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
-                    element = elements[0]
-                    reg_index = get_register(element)
-                    bitstring += bin(reg_index)[2:].zfill(4)
-                    element = elements[1]
-                    addr = get_address(element)
-                    if addr<0 or 65535<addr:
-                        error_line(f"'{addr}' is not in the range [0, 65535]")
-                    bitstring += bin(addr)[2:].zfill(16)
-                elif instruction in [
-                    "add","sub","mul","div",
-                    "and","orr","xor","cmp","mov"
-                ]:
-                    bitstring += "000"
-                    if len(elements) != 2:
-                        error_line(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
-                    for element in elements:
-                        reg_index = get_register(element)
-                        bitstring += bin(reg_index)[2:].zfill(4)
-                elif instruction in [
-                    "not","psh","pop","inc","dec"
-                ]:
-                    bitstring += "000"
-                    if len(elements) != 1:
-                        error_line(f"'{instruction}' takes 1 arguments, {len(elements)} given.")
-                    element = elements[0]
-                    reg_index = get_register(element)
-                    bitstring += bin(reg_index)[2:].zfill(4)
-                    bitstring += "0000"
-                elif instruction in [
-                    "shl","shr"
-                ]:
-                    bitstring += "000"
-                    if len(elements) != 2:
-                        error_line(f"'{instruction}' takes 2 arguments, {len(elements)} given.")
-                    reg_index = get_register(elements[0])
-                    bitstring += bin(reg_index)[2:].zfill(4)
-                    bitstring += "0"
-                    value = get_number(elements[1])
-                    if value<1 or value>8:
-                        error_line("Second argument must be in range [1, 8]")
-                    bitstring += bin(value)[2:].zfill(3)
-                elif instruction in [
-                    "ret","nop","hlt","rti","sei","cli"
-                ]:
-                    bitstring += "000"
-                    if len(elements) != 0:
-                        error_line(f"'{instruction}' takes no arguments, {len(elements)} given.")
-                while len(bitstring) > 0:
-                    byte = int(bitstring[:8], 2)
-                    bitstring = bitstring[8:]
-                    bytelist.append(byte)
-    return bytes(bytelist+array("B", [0 for i in range(2**15-(len(bytelist)))]))
+                pos = end
+            for offset, kind, element, _, _ in fixups:
+                pending.append((base+offset, kind, element, file_name, line_number, line))
+            fixups.clear()
+            if pos >= size:
+                yield base, bytes(data[:pos])
+                base += pos
+                pos = 0
+    # also when empty, as a 'go' at the end sets where the image ends
+    yield base, bytes(data[:pos])
+    for pos, kind, element, file_name, line_number, line in pending:
+        if kind == "check":
+            if element[0] in labels:
+                error_line(f"'{element[0]}' is put as data before it is defined as a label")
+            continue
+        if kind == "put":
+            rest, _, message = element
+            if rest not in labels:
+                error_line(message)
+            addr = resolve(rest)
+        else:
+            addr = resolve(element, "255" if kind == "jif" else "65535")
+        yield pos, bytes([addr>>8, addr&0xff])
+    if failed is not None:
+        message, file_name, line_number, line = failed
+        error_line(message)
+
+# writes chunks from stream() to a file, which ends up as compile() would
+# have made it
+def write_stream(chunks, output_name):
+    end = 2**15
+    with open(output_name, "wb") as file:
+        for base, data in chunks:
+            file.seek(base)
+            file.write(data)
+            end = max(end, base+len(data))
+        # the gaps and the padding read as zeros
+        file.truncate(end)
 
 def main():
     if len(argv) == 1:
@@ -395,9 +918,35 @@ def main():
                 files.pop(index)
             else:
                 error("No output name given after -o")
+        cache = None
+        if "-c" in files:
+            index = files.index("-c")
+            if index+1 < len(files):
+                cache = files[index+1]
+                files.pop(index+1)
+                files.pop(index)
+            else:
+                error("No cache directory given after -c")
+        jobs = None
+        if "-j" in files:
+            index = files.index("-j")
+            if index+1 < len(files) and files[index+1].isdigit():
+                jobs = int(files[index+1])
+                files.pop(index+1)
+                files.pop(index)
+            else:
+                error("No process count given after -j")
+        segmented = "-s" in files
+        if segmented:
+            files.remove("-s")
+        mapped = "-m" in files
+        if mapped:
+            files.remove("-m")
+        optimize = "-O" in files
+        if optimize:
+            files.remove("-O")
         codes = get_input(files)
-        codes = {name: "\n".join([line.split(";")[0] for line in code.split("\n")]) for name, code in codes.items()}
-        bytecode = compile(codes)
+        bytecode, placed = build(codes, cache, jobs, optimize)
         last_line = []
         line_bytes = []
         changed = True
@@ -415,8 +964,14 @@ def main():
                 print(hex(byte)[2:].zfill(2), end=" ")
             print()
         with open(output_name, "wb") as file:
-            file.write(bytecode)
+            if segmented:
+                file.write(pack_segments(segments(bytecode, placed)))
+            else:
+                file.write(bytecode)
         print(f"Saved as '{output_name}'")
+        if mapped:
+            symbol_table(placed).save(output_name+".map")
+            print(f"Symbols saved as '{output_name}.map'")
 
 if __name__ == "__main__":
     main()
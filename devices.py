@@ -0,0 +1,107 @@
+from functools import partial
+
+class Device:
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.emu = None
+
+    def attach(self, emu):
+        self.emu = emu
+
+    def read(self, addr):
+        return self.emu.memory[addr]
+
+    # called after the machine has stored value at addr
+    def written(self, addr, value):
+        pass
+
+    # called when memory under the device changed without a store,
+    # e.g. by load or restore
+    def refresh(self):
+        pass
+
+    # extra state kept in snapshots
+    def save(self):
+        return None
+
+    def restore(self, state):
+        pass
+
+class Keyboard(Device):
+    def __init__(self, addr=0x8000):
+        super().__init__(addr, addr+1)
+
+    def press(self, value):
+        emu = self.emu
+        if emu.interrupt_enable:
+            emu.set_interrupt()
+            emu.store(self.start, value)
+
+class TextDisplay(Device):
+    def __init__(self, start=0xfe00, width=32, height=8):
+        super().__init__(start, start+width*height)
+        self.width = width
+        self.height = height
+        self.dirty = True
+        self.lines = []
+
+    def written(self, addr, value):
+        self.dirty = True
+
+    def refresh(self):
+        self.dirty = True
+
+    def rows(self):
+        if self.dirty:
+            M = self.emu.memory
+            self.lines = [
+                "".join(
+                    chr(byte) if 32 <= byte < 128 else " "
+                    for byte in M[self.start+row*self.width:self.start+(row+1)*self.width]
+                )
+                for row in range(self.height)
+            ]
+            self.dirty = False
+        return self.lines
+
+class Timer(Device):
+    # registers: period high, period low, control (bit 0 running,
+    # bit 1 periodic) and a tick counter bumped on every expiry
+    def __init__(self, addr=0x8010):
+        super().__init__(addr, addr+4)
+        self.armed = 0
+
+    def period(self):
+        M = self.emu.memory
+        return max((M[self.start]<<8)|M[self.start+1], 1)
+
+    def arm(self):
+        # events of earlier armings stay queued and are ignored on expiry
+        self.armed += 1
+        if self.emu.memory[self.start+2]&1:
+            self.emu.schedule(self.period(), partial(self.expire, self.armed))
+
+    def expire(self, armed):
+        emu = self.emu
+        if armed != self.armed:
+            return
+        emu.store(self.start+3, (emu.memory[self.start+3]+1)&0xff)
+        emu.set_interrupt()
+        if emu.memory[self.start+2]&2:
+            self.arm()
+        else:
+            emu.store(self.start+2, emu.memory[self.start+2]&0xfe)
+
+    def written(self, addr, value):
+        if addr == self.start+2:
+            self.arm()
+
+    def refresh(self):
+        self.arm()
+
+    def save(self):
+        return self.armed
+
+    def restore(self, state):
+        self.armed = state
@@ -1,4 +1,27 @@
+from image import is_segmented, read_segments
 from array import array
+from heapq import heappush, heappop
+from mmap import mmap, ACCESS_READ
+from os import fstat
+from sys import argv
+
+PAGE = 256
+EMPTY = [None]*PAGE
+ZEROS = memoryview(bytes(65536))
+
+class Snapshot:
+    def __init__(self, emu, pages):
+        self.program_counter = emu.program_counter
+        self.registers = array("B", emu.registers)
+        self.carry = emu.carry
+        self.zero = emu.zero
+        self.interrupt = emu.interrupt
+        self.interrupt_enable = emu.interrupt_enable
+        self.halted = emu.halted
+        self.pages = pages
+        self.steps = emu.steps
+        self.events = list(emu.events)
+        self.devices = [device.save() for device in emu.attached]
 
 class Emulator:
     def get_function(self, ins):
@@ -42,85 +65,489 @@ class Emulator:
         self.zero = 0
         self.interrupt = 0
         self.interrupt_enable = 0
-        self.instructions = array("B", [0, 0, 0])
         self.halted = False
+        self.table = [self.decode(byte) for byte in range(256)]
+        self.decoded = [None]*65536
+        self.cached = bytearray(65536//PAGE)
+        self.pages = None
+        self.dirty = bytearray(65536//PAGE)
+        self.observers = []
+        # instructions executed so far; scheduled events are keyed on it
+        self.steps = 0
+        self.events = []
+        self.sequence = 0
+        # events scheduled while a chunk is running wait here until the
+        # chunk returns and the step count is up to date again
+        self.running = False
+        self.deferred = []
+        self.preempted = 0
+        # pages holding at least one device address; all other accesses
+        # go straight to memory
+        self.io = bytearray(65536//PAGE)
+        self.devices = {}
+        self.attached = []
+        self.breakpoints = bytearray(65536)
+        self.conditions = {}
+        self.read_watches = bytearray(65536)
+        self.write_watches = bytearray(65536)
+        self.watch_hit = None
+        self.watching = False
+        self.debugging = False
+
+    def decode(self, byte):
+        function = self.get_function((byte&0b11111000)>>3)
+        if function in [
+            self.ret,
+            self.nop,
+            self.hlt,
+            self.rti,
+            self.sei,
+            self.cli,
+        ]:
+            return function, 1
+        if function in [
+            self.cal,
+            self.jmp,
+            self.jif,
+            self.lod,
+            self.sto,
+        ]:
+            return function, 3
+        return function, 2
 
-    def load(self, program):
-        self.program_counter = 0
+    def predecode(self, pc):
+        M = self.memory
+        self.cached[pc//PAGE] = 1
+        first = M[pc]
+        function, length = self.table[first]
+        second = M[(pc+1)&0xffff]
+        third = M[(pc+2)&0xffff]
+        A = (second&0b11110000)>>4
+        B = (second&0b00001111)
+        addr = (second<<8)|third
+        if length == 1:
+            operands = ()
+        elif function in [self.cal, self.jmp]:
+            operands = (addr,)
+        elif function == self.jif:
+            operands = (first&0b00000111, addr)
+        elif function in [self.lod, self.sto]:
+            operands = (first&0b00001111, addr)
+        elif function == self.ldi:
+            operands = (first&0b00001111, second)
+        elif function in [self.shl, self.shr]:
+            operands = (A, second&0b00000111)
+        elif function in [self.not_, self.psh, self.pop, self.inc, self.dec]:
+            operands = (A,)
+        else:
+            operands = (A, B)
+        return function, operands, length
+
+    def store(self, addr, value):
+        self.memory[addr] = value
+        D = self.decoded
+        # an instruction is at most 3 bytes, so only entries starting
+        # up to 2 bytes before addr can cover it
+        D[addr] = D[addr-1] = D[addr-2] = None
+        self.dirty[addr//PAGE] = 1
+        if self.io[addr//PAGE]:
+            device = self.devices.get(addr)
+            if device is not None:
+                device.written(addr, value)
+
+    def read(self, addr):
+        device = self.devices.get(addr)
+        if device is None:
+            return self.memory[addr]
+        return device.read(addr)
+
+    def attach(self, device):
+        if device.end > 0xff00:
+            raise ValueError("devices cannot be mapped into the stack page")
+        for addr in range(device.start, device.end):
+            if addr in self.devices:
+                raise ValueError(f"{addr:04x} is already mapped to a device")
+        for addr in range(device.start, device.end):
+            self.devices[addr] = device
+            self.io[addr//PAGE] = 1
+        self.attached.append(device)
+        device.attach(self)
+
+    def invalidate(self, start, end):
+        D = self.decoded
+        D[start-1] = D[start-2] = None
+        cached = self.cached
+        io = False
+        for page in range(start//PAGE, (end-1)//PAGE+1):
+            if cached[page]:
+                D[page*PAGE:(page+1)*PAGE] = EMPTY
+                cached[page] = 0
+            io = io or self.io[page]
+        if io:
+            for device in self.attached:
+                if device.start < end and start < device.end:
+                    device.refresh()
+
+    def snapshot(self):
+        # pages not written since the last snapshot or restore are shared
+        # with it instead of copied
+        last = self.pages
+        dirty = self.dirty
+        with memoryview(self.memory) as view:
+            pages = tuple(
+                bytes(view[page*PAGE:(page+1)*PAGE])
+                if last is None or dirty[page] else last[page]
+                for page in range(len(dirty))
+            )
+        self.pages = pages
+        dirty[:] = bytes(len(dirty))
+        return Snapshot(self, pages)
+
+    def restore(self, snap):
+        last = self.pages
+        dirty = self.dirty
+        with memoryview(self.memory) as view:
+            for page, data in enumerate(snap.pages):
+                if last is None or dirty[page] or last[page] is not data:
+                    view[page*PAGE:(page+1)*PAGE] = data
+                    self.invalidate(page*PAGE, (page+1)*PAGE)
+        self.pages = snap.pages
+        dirty[:] = bytes(len(dirty))
+        self.program_counter = snap.program_counter
+        self.registers[:] = snap.registers
+        self.carry = snap.carry
+        self.zero = snap.zero
+        self.interrupt = snap.interrupt
+        self.interrupt_enable = snap.interrupt_enable
+        self.halted = snap.halted
+        self.steps = snap.steps
+        self.events[:] = snap.events
+        for device, state in zip(self.attached, snap.devices):
+            device.restore(state)
+
+    def load(self, program, base=0):
+        self.load_segments([(base, program)], base)
+
+    # writes only the given (base, bytes) ranges, the rest of memory is
+    # left as it is. They are written as they come, so they can be
+    # streamed from the assembler
+    def load_segments(self, segments, entry=0):
+        ranges = []
+        with memoryview(self.memory) as view:
+            for base, program in segments:
+                end = base+len(program)
+                if base < 0 or end > 65536:
+                    raise ValueError(f"program of {len(program)} bytes does not fit at {base:04x}")
+                view[base:end] = program
+                ranges.append((base, end))
+        # a load restarts guest time, so devices re-arm their events
+        self.steps = 0
+        self.events.clear()
+        for device in self.attached:
+            device.refresh()
+        for base, end in ranges:
+            if end > base:
+                self.invalidate(base, end)
+                self.dirty[base//PAGE:(end-1)//PAGE+1] = b"\x01"*((end-1)//PAGE+1-base//PAGE)
+        self.program_counter = entry
         self.registers[0xf] = 0
-        self.memory = array("B", program)+self.memory[len(program):]
         self.interrupt = 0
         self.interrupt_enable = 0
         self.halted = False
 
+    # a padded image or a segmented one. The gaps between segments are
+    # zeroed in place, as a padded image would have them, but memory past
+    # the last segment is left as it is, so a small image stays a few
+    # bytes to load; load_segments() writes only the segments
+    def load_image(self, image, base=0):
+        if not is_segmented(image):
+            self.load(image, base)
+            return
+        segments = sorted(read_segments(image), key=lambda segment: segment[0])
+        gaps = []
+        end = 0
+        for start, program in segments:
+            if start > end:
+                gaps.append((end, ZEROS[:start-end]))
+            end = max(end, start+len(program))
+        self.load_segments(gaps+segments)
+
+    def load_file(self, file_name, base=0):
+        with open(file_name, "rb") as file:
+            if fstat(file.fileno()).st_size == 0:
+                self.load(b"", base)
+                return
+            with mmap(file.fileno(), 0, access=ACCESS_READ) as image:
+                self.load_image(image, base)
+
+    def observe(self, observer):
+        self.observers.append(observer)
+
+    def unobserve(self, observer):
+        self.observers.remove(observer)
+
     def step(self):
         if self.halted:
             return
-        self.instructions[0] = self.memory[self.program_counter]
-        self.program_counter = (self.program_counter+1)&0xffff
-        function = self.get_function((self.instructions[0]&0b11111000)>>3)
-        if function not in [
-            self.ret,
-            self.nop,
-            self.hlt,
-            self.rti,
-            self.sei,
-            self.cli,
-        ]:
-            self.instructions[1] = self.memory[self.program_counter]
-            self.program_counter += 1
-            if function in [
-                self.cal,
-                self.jmp,
-                self.jif,
-                self.lod,
-                self.sto,
-            ]:
-                self.instructions[2] = self.memory[self.program_counter]
-                self.program_counter += 1
-        function()
+        if self.events and self.events[0][0] <= self.steps:
+            self.fire()
+        self.running = True
+        try:
+            self.advance()
+            self.steps += 1
+        finally:
+            self.running = False
+            if self.deferred:
+                self.settle()
+
+    def advance(self):
+        pc = self.program_counter
+        for observer in self.observers:
+            observer(self, pc)
+        entry = self.decoded[pc]
+        if entry is None:
+            entry = self.decoded[pc] = self.predecode(pc)
+        function, operands, length = entry
+        self.program_counter = (pc+length)&0xffff
+        function(*operands)
         if self.interrupt == 1 and self.interrupt_enable == 1:
-            R = self.registers
-            M = self.memory
-            c = self.carry
-            z = self.zero
-            F = (z<<1)|c
-            PC = self.program_counter
-            M[0xff00+R[0xf]] = (PC&0xff00)>>8
-            R[0xf] = (R[0xf]+1)&0xff
-            M[0xff00+R[0xf]] = PC&0x00ff
-            R[0xf] = (R[0xf]+1)&0xff
-            M[0xff00+R[0xf]] = F
-            R[0xf] = (R[0xf]+1)&0xff
-            addr = (M[0x7ffe]<<8)|M[0x7fff]
-            self.program_counter = addr
-            self.interrupt_enable = 0
+            self.enter_interrupt()
+
+    def run(self, max_steps=None, until_pc=None, cycle_budget=None):
+        if self.halted:
+            return "halted", 0
+        if max_steps is None:
+            max_steps = -1
+        if until_pc is None:
+            until_pc = -1
+        if cycle_budget is None:
+            cycle_budget = -1
+        if self.observers or self.debugging:
+            execute = self.run_observed
+        else:
+            execute = self.execute
+        steps = 0
+        cycles = 0
+        while True:
+            if self.events and self.events[0][0] <= self.steps:
+                self.fire()
+            # run unthrottled up to the next scheduled event
+            limit = max_steps-steps if max_steps >= 0 else -1
+            if self.events:
+                due = self.events[0][0]-self.steps
+                if limit < 0 or due < limit:
+                    limit = due
+            budget = cycle_budget-cycles if cycle_budget >= 0 else -1
+            self.running = True
+            try:
+                reason, done, used = execute(limit, until_pc, budget, steps == 0)
+                steps += done
+                cycles += used
+                self.steps += done
+            finally:
+                self.running = False
+                if self.deferred:
+                    self.settle()
+            if reason != "max_steps" or steps == max_steps:
+                return reason, steps
+
+    def schedule(self, delay, callback):
+        if self.running:
+            self.deferred.append((delay, callback))
+            self.preempt()
+            return
+        self.sequence += 1
+        heappush(self.events, (self.steps+delay, self.sequence, callback))
+
+    # makes the running chunk return before its next instruction
+    def preempt(self):
+        self.preempted = 1
+        self.decoded[self.program_counter] = None
+
+    def settle(self):
+        deferred = self.deferred
+        self.deferred = []
+        self.preempted = 0
+        for delay, callback in deferred:
+            self.schedule(delay, callback)
+
+    def fire(self):
+        events = self.events
+        while events and events[0][0] <= self.steps:
+            heappop(events)[2]()
+
+    def execute(self, max_steps, until_pc, cycle_budget, resuming):
+        D = self.decoded
+        predecode = self.predecode
+        pc = self.program_counter
+        pending = self.interrupt
+        steps = 0
+        cycles = 0
+        while steps != max_steps:
+            entry = D[pc]
+            if entry is None:
+                if self.preempted:
+                    return "max_steps", steps, cycles
+                entry = D[pc] = predecode(pc)
+            function, operands, length = entry
+            self.program_counter = (pc+length)&0xffff
+            function(*operands)
+            steps += 1
+            # only one-byte instructions can halt or re-enable interrupts
+            if length == 1 or pending:
+                pending = 0
+                if self.interrupt == 1 and self.interrupt_enable == 1:
+                    self.enter_interrupt()
+                if self.halted:
+                    return "halted", steps, cycles
+            pc = self.program_counter
+            if pc == until_pc:
+                return "until_pc", steps, cycles
+            if cycle_budget >= 0:
+                cycles += length
+                if cycles >= cycle_budget:
+                    return "cycle_budget", steps, cycles
+        return "max_steps", steps, cycles
+
+    def run_observed(self, max_steps, until_pc, cycle_budget, resuming):
+        table = self.table
+        M = self.memory
+        breakpoints = self.breakpoints
+        watching = self.watching
+        steps = 0
+        cycles = 0
+        while steps != max_steps:
+            pc = self.program_counter
+            # the instruction a run starts on never stops it, so a run
+            # can be resumed from a breakpoint
+            if (steps or not resuming) and breakpoints[pc] and self.hit(pc):
+                return "breakpoint", steps, cycles
+            if watching:
+                reads, writes = self.accesses(pc)
+            cycles += table[M[pc]][1]
+            self.advance()
+            steps += 1
+            if watching and self.watched(reads, writes):
+                return "watchpoint", steps, cycles
+            if self.halted:
+                return "halted", steps, cycles
+            if self.program_counter == until_pc:
+                return "until_pc", steps, cycles
+            if cycle_budget >= 0 and cycles >= cycle_budget:
+                return "cycle_budget", steps, cycles
+            if self.preempted:
+                return "max_steps", steps, cycles
+        return "max_steps", steps, cycles
+
+    def add_breakpoint(self, addr, condition=None):
+        self.breakpoints[addr] = 1
+        self.conditions.setdefault(addr, []).append(condition)
+        self.debugging = True
+
+    def remove_breakpoint(self, addr):
+        self.breakpoints[addr] = 0
+        self.conditions.pop(addr, None)
+        self.update_debugging()
+
+    def hit(self, pc):
+        for condition in self.conditions[pc]:
+            if condition is None or condition(self):
+                return True
+        return False
+
+    def add_watchpoint(self, start, end=None, read=False, write=True):
+        if end is None:
+            end = start+1
+        if read:
+            self.read_watches[start:end] = b"\x01"*(end-start)
+        if write:
+            self.write_watches[start:end] = b"\x01"*(end-start)
+        self.update_debugging()
+
+    def remove_watchpoint(self, start, end=None, read=True, write=True):
+        if end is None:
+            end = start+1
+        if read:
+            self.read_watches[start:end] = bytes(end-start)
+        if write:
+            self.write_watches[start:end] = bytes(end-start)
+        self.update_debugging()
+
+    def update_debugging(self):
+        self.watching = any(self.read_watches) or any(self.write_watches)
+        self.debugging = self.watching or any(self.breakpoints)
+
+    def accesses(self, pc):
+        entry = self.decoded[pc]
+        if entry is None:
+            entry = self.decoded[pc] = self.predecode(pc)
+        function, operands, length = entry
+        sp = 0xff00+self.registers[0xf]
+        reads = ()
+        writes = ()
+        if function == self.lod:
+            reads = ((operands[1]+self.registers[0xe])%65536,)
+        elif function == self.sto:
+            writes = ((operands[1]+self.registers[0xe])%65536,)
+        elif function == self.psh:
+            writes = (sp,)
+        elif function == self.cal:
+            writes = (sp, 0xff00|((sp+1)&0xff))
+        elif function == self.pop:
+            reads = (0xff00|((sp-1)&0xff),)
+        elif function == self.ret:
+            reads = tuple(0xff00|((sp-i)&0xff) for i in (1, 2))
+        elif function == self.rti:
+            reads = tuple(0xff00|((sp-i)&0xff) for i in (1, 2, 3))
+        return reads, writes
+
+    def watched(self, reads, writes):
+        for addr in reads:
+            if self.read_watches[addr]:
+                self.watch_hit = ("read", addr)
+                return True
+        for addr in writes:
+            if self.write_watches[addr]:
+                self.watch_hit = ("write", addr)
+                return True
+        return False
+
+    def enter_interrupt(self):
+        R = self.registers
+        M = self.memory
+        c = self.carry
+        z = self.zero
+        F = (z<<1)|c
+        PC = self.program_counter
+        self.store(0xff00+R[0xf], (PC&0xff00)>>8)
+        R[0xf] = (R[0xf]+1)&0xff
+        self.store(0xff00+R[0xf], PC&0x00ff)
+        R[0xf] = (R[0xf]+1)&0xff
+        self.store(0xff00+R[0xf], F)
+        R[0xf] = (R[0xf]+1)&0xff
+        addr = (M[0x7ffe]<<8)|M[0x7fff]
+        self.program_counter = addr
+        self.interrupt_enable = 0
 
     def set_interrupt(self):
         if self.interrupt_enable:
             self.interrupt = 1
 
-    def add(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def add(self, A, B):
         R = self.registers
         result = R[A]+R[B]
         self.carry = int(result >= 256)
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def sub(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def sub(self, A, B):
         R = self.registers
         result = R[A]-R[B]
         self.carry = int(result < 0)
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def mul(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def mul(self, A, B):
         R = self.registers
         result = R[A]*R[B]
         R[A] = (result&0xff00)>>8
@@ -128,9 +555,7 @@ class Emulator:
         self.carry = int(R[A] > 0)
         self.zero = int(R[B] == 0)
 
-    def div(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def div(self, A, B):
         R = self.registers
         high = R[A]//R[B]
         low = R[A]%R[B]
@@ -139,78 +564,62 @@ class Emulator:
         self.carry = int(R[A] > 0)
         self.zero = int(R[B] == 0)
 
-    def shl(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        o = (self.instructions[1]&0b00000111)
+    def shl(self, A, o):
         R = self.registers
         result = R[A]<<o
         self.carry = (R[A]&0b10000000)>>7
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def shr(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        o = (self.instructions[1]&0b00000111)
+    def shr(self, A, o):
         R = self.registers
         result = R[A]>>o
         self.carry = (R[A]&0b00000001)
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def and_(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def and_(self, A, B):
         R = self.registers
         result = R[A]&R[B]
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def orr(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def orr(self, A, B):
         R = self.registers
         result = R[A]|R[B]
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def xor(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def xor(self, A, B):
         R = self.registers
         result = R[A]^R[B]
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def not_(self):
-        A = (self.instructions[1]&0b11110000)>>4
+    def not_(self, A):
         R = self.registers
         result = ~R[A]
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def psh(self):
-        A = (self.instructions[1]&0b11110000)>>4
+    def psh(self, A):
         R = self.registers
-        M = self.memory
-        M[0xff00+R[0xf]] = R[A]
+        self.store(0xff00+R[0xf], R[A])
         R[0xf] = (R[0xf]+1)&0xff
 
-    def pop(self):
-        A = (self.instructions[1]&0b11110000)>>4
+    def pop(self, A):
         R = self.registers
         M = self.memory
         R[0xf] = (R[0xf]-1)&0xff
         R[A] = M[0xff00+R[0xf]]
 
-    def cal(self):
-        addr = (self.instructions[1]<<8)|self.instructions[2]
+    def cal(self, addr):
         R = self.registers
-        M = self.memory
         high = (self.program_counter&0xff00)>>8
         low = (self.program_counter&0x00ff)
-        M[0xff00+R[0xf]] = high
+        self.store(0xff00+R[0xf], high)
         R[0xf] = (R[0xf]+1)&0xff
-        M[0xff00+R[0xf]] = low
+        self.store(0xff00+R[0xf], low)
         R[0xf] = (R[0xf]+1)&0xff
         self.program_counter = addr
 
@@ -223,13 +632,10 @@ class Emulator:
         high = M[0xff00+R[0xf]]
         self.program_counter = (high<<8)|low
 
-    def jmp(self):
-        addr = (self.instructions[1]<<8)|self.instructions[2]
+    def jmp(self, addr):
         self.program_counter = addr
 
-    def jif(self):
-        zcs = self.instructions[0]&0b00000111
-        addr = (self.instructions[1]<<8)|self.instructions[2]
+    def jif(self, zcs, addr):
         if (
             zcs == 0b101 and self.zero == 1 or
             zcs == 0b100 and self.zero == 0 or
@@ -238,50 +644,41 @@ class Emulator:
         ):
             self.program_counter = addr
 
-    def lod(self):
-        A = self.instructions[0]&0b00001111
-        addr = (self.instructions[1]<<8)|self.instructions[2]
+    def lod(self, A, addr):
         R = self.registers
-        M = self.memory
         addr = (addr+R[0xe])%65536
-        R[A] = M[addr]
+        if self.io[addr//PAGE]:
+            R[A] = self.read(addr)
+        else:
+            R[A] = self.memory[addr]
         self.zero = int(R[A] == 0)
 
-    def ldi(self):
-        A = self.instructions[0]&0b00001111
-        imm = self.instructions[1]
+    def ldi(self, A, imm):
         R = self.registers
         R[A] = imm
         self.zero = int(R[A] == 0)
 
-    def sto(self):
-        A = self.instructions[0]&0b00001111
-        addr = (self.instructions[1]<<8)|self.instructions[2]
+    def sto(self, A, addr):
         R = self.registers
-        M = self.memory
         addr = (addr+R[0xe])%65536
-        M[addr] = R[A]
+        self.store(addr, R[A])
         self.zero = int(R[A] == 0)
 
-    def inc(self):
-        A = (self.instructions[1]&0b11110000)>>4
+    def inc(self, A):
         R = self.registers
         result = R[A]+1
         self.carry = int(result >= 256)
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def dec(self):
-        A = (self.instructions[1]&0b11110000)>>4
+    def dec(self, A):
         R = self.registers
         result = R[A]-1
         self.carry = int(result < 0)
         R[A] = (result)&0xff
         self.zero = int(R[A] == 0)
 
-    def cmp(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def cmp(self, A, B):
         R = self.registers
         result = R[A]-R[B]
         self.carry = int(result < 0)
@@ -293,9 +690,7 @@ class Emulator:
     def hlt(self):
         self.halted = True
 
-    def mov(self):
-        A = (self.instructions[1]&0b11110000)>>4
-        B = (self.instructions[1]&0b00001111)
+    def mov(self, A, B):
         R = self.registers
         R[B] = R[A]
 
@@ -320,3 +715,19 @@ class Emulator:
     def cli(self):
         self.interrupt_enable = 0
 
+
+def help():
+    print("""
+Usage:
+    emulator batch [OPTIONS] <dir|glob|file...>
+""")
+
+def main():
+    if len(argv) > 1 and argv[1] == "batch":
+        from runner import main as batch
+        batch(argv[2:])
+    else:
+        help()
+
+if __name__ == "__main__":
+    main()
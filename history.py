@@ -0,0 +1,169 @@
+from emulator import PAGE
+from bisect import bisect_right
+from functools import partial
+from time import perf_counter
+
+# rough size of a snapshot besides its pages
+OVERHEAD = 4096
+
+class History:
+    def __init__(self, emu, recorder=None, latency=0.05, memory=64<<20):
+        self.emu = emu
+        # keys pressed by the user have to be pressed again when
+        # re-executing, so they are taken from the recorder
+        self.recorder = recorder
+        self.latency = latency
+        self.memory = memory
+        self.speed = 1000000
+        # checkpoints closer to the present than ratio times their
+        # distance to the next older one are thinned out
+        self.ratio = 16
+        self.steps = []
+        self.snapshots = []
+        self.size = 0
+        self.limit = 64
+        self.armed = 0
+
+    def interval(self):
+        return max(1000, int(self.latency*self.speed))
+
+    def reset(self):
+        self.steps = []
+        self.snapshots = []
+        self.size = 0
+        self.ratio = 16
+        self.checkpoint()
+        self.arm()
+
+    def arm(self):
+        self.armed += 1
+        self.emu.schedule(self.interval(), partial(self.take, self.armed))
+
+    def take(self, armed):
+        # events queued before a reset or a seek are ignored, so nothing
+        # is taken while re-executing
+        if armed != self.armed:
+            return
+        self.checkpoint()
+        self.arm()
+
+    def checkpoint(self):
+        emu = self.emu
+        if self.steps and emu.steps <= self.steps[-1]:
+            return
+        snap = emu.snapshot()
+        if self.snapshots:
+            last = self.snapshots[-1].pages
+            self.size += sum(page is not other for page, other in zip(snap.pages, last))*PAGE
+        else:
+            self.size += len(snap.pages)*PAGE
+        self.size += OVERHEAD
+        self.steps.append(emu.steps)
+        self.snapshots.append(snap)
+        if self.size > self.memory or len(self.steps) >= self.limit:
+            self.thin()
+
+    def measure(self):
+        pages = set()
+        for snap in self.snapshots:
+            pages.update(map(id, snap.pages))
+        return len(pages)*PAGE+len(self.snapshots)*OVERHEAD
+
+    def thin(self):
+        while True:
+            now = self.emu.steps
+            interval = self.interval()
+            steps = [self.steps[-1]]
+            snapshots = [self.snapshots[-1]]
+            for i in range(len(self.steps)-2, 0, -1):
+                if steps[-1]-self.steps[i] >= max(interval, (now-self.steps[i])//self.ratio):
+                    steps.append(self.steps[i])
+                    snapshots.append(self.snapshots[i])
+            # the oldest checkpoint is always kept
+            if len(self.steps) > 1:
+                steps.append(self.steps[0])
+                snapshots.append(self.snapshots[0])
+            self.steps = steps[::-1]
+            self.snapshots = snapshots[::-1]
+            self.size = self.measure()
+            if self.size <= self.memory or self.ratio == 1:
+                break
+            self.ratio = max(1, self.ratio//2)
+        self.limit = max(64, 2*len(self.steps))
+
+    def seek(self, target):
+        emu = self.emu
+        i = bisect_right(self.steps, target)-1
+        if i < 0:
+            return False
+        observers = emu.observers
+        debugging = emu.debugging
+        emu.observers = []
+        emu.debugging = False
+        try:
+            self.replay(i, target)
+            start = perf_counter()
+            emu.run(max_steps=target-emu.steps)
+            elapsed = perf_counter()-start
+        finally:
+            emu.observers = observers
+            emu.debugging = debugging
+        if target-self.steps[i] >= 1000 and elapsed > 0:
+            self.speed = (self.speed+(target-self.steps[i])/elapsed)/2
+        if self.recorder is not None:
+            for steps, value in self.recorder.presses():
+                if steps == target:
+                    self.recorder.keyboard.press(value)
+            self.recorder.truncate(target)
+        # the future is discarded, since the user may change it
+        del self.steps[i+1:]
+        del self.snapshots[i+1:]
+        self.size = self.measure()
+        self.arm()
+        return True
+
+    def replay(self, i, end):
+        emu = self.emu
+        emu.restore(self.snapshots[i])
+        if self.recorder is not None:
+            press = self.recorder.keyboard.press
+            for steps, value in self.recorder.presses():
+                if self.steps[i] <= steps < end:
+                    emu.schedule(steps-emu.steps, partial(press, value))
+
+    def step_back(self, n=1):
+        if not self.steps:
+            return 0
+        target = max(self.emu.steps-n, self.steps[0])
+        moved = self.emu.steps-target
+        self.seek(target)
+        return moved
+
+    def reverse_continue(self):
+        emu = self.emu
+        end = emu.steps
+        observers = emu.observers
+        watching = emu.watching
+        emu.observers = []
+        emu.watching = False
+        found = None
+        try:
+            i = bisect_right(self.steps, end-1)-1
+            while i >= 0 and found is None and emu.debugging:
+                self.replay(i, end)
+                if emu.breakpoints[emu.program_counter] and emu.hit(emu.program_counter):
+                    found = emu.steps
+                while emu.steps < end and not emu.halted:
+                    reason, _ = emu.run(max_steps=end-emu.steps)
+                    if reason == "breakpoint" and emu.steps < end:
+                        found = emu.steps
+                end = self.steps[i]
+                i -= 1
+        finally:
+            emu.observers = observers
+            emu.watching = watching
+        if found is None:
+            self.seek(self.steps[0])
+            return "start"
+        self.seek(found)
+        return "breakpoint"
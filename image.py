@@ -0,0 +1,35 @@
+MAGIC = b"EMSG"
+
+# a segmented image holds only the populated address ranges: the magic,
+# a 4 byte segment count, then for each segment its base address
+# (2 bytes), its length (4 bytes, so a whole 64 KiB fits) and its bytes,
+# all big endian
+def pack_segments(segments):
+    data = bytearray(MAGIC)
+    data += len(segments).to_bytes(4, "big")
+    for base, chunk in segments:
+        data += base.to_bytes(2, "big")
+        data += len(chunk).to_bytes(4, "big")
+        data += chunk
+    return bytes(data)
+
+def is_segmented(data):
+    return data[:4] == MAGIC
+
+def read_segments(data):
+    if not is_segmented(data):
+        raise ValueError("not a segmented image")
+    count = int.from_bytes(data[4:8], "big")
+    segments = []
+    pos = 8
+    for _ in range(count):
+        if pos+6 > len(data):
+            raise ValueError("segmented image is cut short")
+        base = int.from_bytes(data[pos:pos+2], "big")
+        length = int.from_bytes(data[pos+2:pos+6], "big")
+        pos += 6
+        if pos+length > len(data):
+            raise ValueError("segmented image is cut short")
+        segments.append((base, data[pos:pos+length]))
+        pos += length
+    return segments
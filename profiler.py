@@ -0,0 +1,102 @@
+from emulator import Emulator
+from tracer import names
+from symbols import find_symbols
+from array import array
+from sys import argv, stdout
+
+CAL = 0b01100
+RET = 0b01101
+DEPTH = 128
+
+class Profiler:
+    def __init__(self):
+        self.opcodes = array("Q", [0]*32)
+        self.addresses = array("Q", [0]*65536)
+        # executed instructions per call stack; a stack is the tuple of
+        # subroutine addresses entered with cal and not yet left with ret
+        self.stacks = {}
+        self.stack = ()
+
+    def count(self, emu, pc):
+        M = emu.memory
+        ins = M[pc]>>3
+        self.opcodes[ins] += 1
+        self.addresses[pc] += 1
+        stack = self.stack
+        stacks = self.stacks
+        stacks[stack] = stacks.get(stack, 0)+1
+        if ins == CAL:
+            # the 256 byte hardware stack holds at most DEPTH return
+            # addresses, so deeper frames have overwritten the oldest
+            if len(stack) >= DEPTH:
+                stack = stack[1:]
+            self.stack = stack+((M[(pc+1)&0xffff]<<8)|M[(pc+2)&0xffff],)
+        elif ins == RET and stack:
+            self.stack = stack[:-1]
+
+    def clear(self):
+        self.opcodes = array("Q", [0]*32)
+        self.addresses = array("Q", [0]*65536)
+        self.stacks = {}
+        self.stack = ()
+
+    def subroutines(self):
+        inclusive = {}
+        exclusive = {}
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            for addr in set(stack):
+                inclusive[addr] = inclusive.get(addr, 0)+count
+            exclusive[stack[-1]] = exclusive.get(stack[-1], 0)+count
+        return inclusive, exclusive
+
+    def write_table(self, file=stdout, limit=20, symbols=None):
+        where = symbols.describe if symbols is not None else lambda addr: ""
+        total = sum(self.opcodes) or 1
+        print("opcode      count       %", file=file)
+        for ins in sorted(range(32), key=lambda ins: -self.opcodes[ins]):
+            if self.opcodes[ins]:
+                print(f"{names[ins<<3]:<6}{self.opcodes[ins]:>11}{100*self.opcodes[ins]/total:>8.2f}", file=file)
+        print("\naddress     count       %", file=file)
+        hot = sorted((addr for addr in range(65536) if self.addresses[addr]), key=lambda addr: -self.addresses[addr])
+        for addr in hot[:limit]:
+            print(f"{addr:04x}  {self.addresses[addr]:>11}{100*self.addresses[addr]/total:>8.2f}  {where(addr)}".rstrip(), file=file)
+        inclusive, exclusive = self.subroutines()
+        if inclusive:
+            print("\nsubroutine  inclusive   exclusive", file=file)
+            for addr in sorted(inclusive, key=lambda addr: -inclusive[addr]):
+                print(f"{addr:04x}  {inclusive[addr]:>11} {exclusive.get(addr, 0):>11}  {where(addr)}".rstrip(), file=file)
+
+    def write_collapsed(self, file_name, name=None):
+        if name is None:
+            name = lambda addr: f"{addr:04x}"
+        with open(file_name, "w") as file:
+            for stack, count in sorted(self.stacks.items()):
+                frames = ["root"]+[name(addr) for addr in stack]
+                print(";".join(frames), count, file=file)
+
+def main():
+    if len(argv) < 2:
+        print("Usage: profiler.py <image> [steps] [-c <collapsed output>]")
+        return
+    args = argv[1:]
+    collapsed = None
+    if "-c" in args:
+        index = args.index("-c")
+        collapsed = args[index+1]
+        args = args[:index]+args[index+2:]
+    emu = Emulator()
+    emu.load_file(args[0])
+    profiler = Profiler()
+    emu.observe(profiler.count)
+    reason, steps = emu.run(max_steps=int(args[1]) if len(args) > 1 else 1000000)
+    print(f"{steps} steps, stopped: {reason}\n")
+    # labels and source lines, if cmc saved symbols next to the image
+    symbols = find_symbols(args[0])
+    profiler.write_table(symbols=symbols)
+    if collapsed:
+        profiler.write_collapsed(collapsed, symbols.name if symbols is not None else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from emulator import Emulator
+from devices import Keyboard, TextDisplay, Timer
+from functools import partial
+from sys import argv
+from time import perf_counter
+
+MAGIC = b"EMRR"
+RECORD = 9
+
+class Recorder:
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+        # each record is the instruction count the key was pressed at
+        # (8 bytes, big endian) followed by the data byte
+        self.log = bytearray()
+
+    def press(self, value):
+        self.log += self.keyboard.emu.steps.to_bytes(8, "big")
+        self.log.append(value)
+        self.keyboard.press(value)
+
+    def clear(self):
+        self.log = bytearray()
+
+    def presses(self):
+        return decode(self.log)
+
+    # forgets the keys pressed after the given instruction count
+    def truncate(self, steps):
+        presses = self.presses()
+        count = len(presses)
+        while count and presses[count-1][0] > steps:
+            count -= 1
+        del self.log[count*RECORD:]
+
+    def save(self, file_name):
+        with open(file_name, "wb") as file:
+            file.write(MAGIC)
+            file.write((len(self.log)//RECORD).to_bytes(4, "big"))
+            # the session length, so a replay stops where the session did
+            file.write(self.keyboard.emu.steps.to_bytes(8, "big"))
+            file.write(self.log)
+
+def decode(data):
+    return [
+        (int.from_bytes(data[i:i+8], "big"), data[i+8])
+        for i in range(0, len(data), RECORD)
+    ]
+
+def read_log(file_name):
+    with open(file_name, "rb") as file:
+        data = file.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"'{file_name}' is not a recording")
+    count = int.from_bytes(data[4:8], "big")
+    length = int.from_bytes(data[8:16], "big")
+    return decode(data[16:16+count*RECORD]), length
+
+def replay(emu, keyboard, presses):
+    for steps, value in presses:
+        emu.schedule(steps-emu.steps, partial(keyboard.press, value))
+
+def main():
+    if len(argv) < 3:
+        print("Usage: recorder.py <image> <recording> [steps]")
+        return
+    emu = Emulator()
+    keyboard = Keyboard(0x8000)
+    display = TextDisplay(0xfe00, 32, 8)
+    emu.attach(keyboard)
+    emu.attach(display)
+    emu.attach(Timer(0x8010))
+    emu.load_file(argv[1])
+    presses, length = read_log(argv[2])
+    replay(emu, keyboard, presses)
+    start = perf_counter()
+    reason, steps = emu.run(max_steps=int(argv[3]) if len(argv) > 3 else length)
+    elapsed = perf_counter()-start
+    # keys pressed after the last instruction of the session
+    for at, value in presses:
+        if at == length == emu.steps:
+            keyboard.press(value)
+    print(f"{steps} steps in {elapsed:.3f}s ({steps/max(elapsed, 1e-9):,.0f} steps/sec), stopped: {reason}")
+    print(f"PC: {emu.program_counter:04x}  Z: {emu.zero}  C: {emu.carry}  IE: {emu.interrupt_enable}")
+    print("regs:", " ".join(f"{r:02x}" for r in emu.registers))
+    for row in display.rows():
+        print("|"+row+"|")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+from emulator import Emulator
+from image import is_segmented
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from json import dumps
+from os import path, listdir, cpu_count
+from sys import stdout, stderr
+from time import perf_counter
+
+def help():
+    print("""
+Usage:
+    emulator batch [OPTIONS] <dir|glob|file...>
+
+Options:
+    -s <steps>  Stop each image after this
+                many steps. (default 1000000)
+    -j <jobs>   Number of worker processes.
+    -o <name>   Write the JSON lines to a
+                file instead of stdout.
+""")
+
+# a segmented image, or a padded one, which cmc makes at least 32 KiB
+# and which has to fit the address space. Symbol files, which can be as
+# large, and anything else found by a directory scan or a glob are
+# skipped
+def is_image(file_name):
+    if not path.isfile(file_name) or file_name.endswith(".map"):
+        return False
+    size = path.getsize(file_name)
+    if 2**15 <= size <= 65536:
+        return True
+    with open(file_name, "rb") as file:
+        return is_segmented(file.read(4))
+
+def find_images(patterns):
+    images = []
+    for pattern in patterns:
+        if path.isdir(pattern):
+            names = sorted(listdir(pattern))
+            images += [path.join(pattern, name) for name in names if is_image(path.join(pattern, name))]
+        elif path.isfile(pattern):
+            images.append(pattern)
+        else:
+            images += [name for name in sorted(glob(pattern)) if is_image(name)]
+    return images
+
+def run_image(file_name, max_steps):
+    emu = Emulator()
+    start = perf_counter()
+    try:
+        emu.load_file(file_name)
+        reason, steps = emu.run(max_steps=max_steps)
+        error = None
+    except Exception as exception:
+        reason, steps = "error", None
+        error = f"{type(exception).__name__}: {exception}"
+    result = {
+        "image": file_name,
+        "halt_reason": reason,
+        "steps": steps,
+        "pc": emu.program_counter,
+        "registers": list(emu.registers),
+        "zero": emu.zero,
+        "carry": emu.carry,
+        "interrupt_enable": emu.interrupt_enable,
+        "wall_time": perf_counter()-start,
+    }
+    if error is not None:
+        result["error"] = error
+    return result
+
+def main(args):
+    max_steps = 1000000
+    jobs = cpu_count()
+    output = None
+    args = list(args)
+    for option in ["-s", "-j", "-o"]:
+        if option in args:
+            index = args.index(option)
+            if index+1 >= len(args):
+                print(f"Error: No value given after {option}", file=stderr)
+                exit(1)
+            value = args.pop(index+1)
+            args.pop(index)
+            if option == "-o":
+                output = value
+            elif not value.isdigit():
+                print(f"Error: {option} takes a number, got: {value}", file=stderr)
+                exit(1)
+            elif option == "-s":
+                max_steps = int(value)
+            else:
+                jobs = max(1, int(value))
+    if len(args) == 0:
+        help()
+        return
+    images = find_images(args)
+    file = open(output, "w") if output else stdout
+    try:
+        with ProcessPoolExecutor(jobs) as executor:
+            for result in executor.map(run_image, images, [max_steps]*len(images)):
+                print(dumps(result), file=file, flush=True)
+    finally:
+        if output:
+            file.close()
@@ -0,0 +1,69 @@
+from bisect import bisect_left, bisect_right
+from json import dump, load
+from os import path
+
+class Symbols:
+    def __init__(self, files=(), lines=(), labels=()):
+        self.files = list(files)
+        # (address, length, file index, line number) of the bytes of each
+        # line and (address, name) of each label, both sorted by address
+        self.lines = sorted(lines)
+        self.starts = [entry[0] for entry in self.lines]
+        self.labels = sorted(labels, key=lambda label: label[0])
+        self.addresses = [addr for addr, _ in self.labels]
+
+    def source(self, addr):
+        i = bisect_right(self.starts, addr)-1
+        if i < 0:
+            return None
+        start, length, file, line = self.lines[i]
+        if addr >= start+length:
+            return None
+        return self.files[file], line
+
+    # the closest label at or below the address and the distance to it
+    def label(self, addr):
+        i = bisect_right(self.addresses, addr)-1
+        if i < 0:
+            return None
+        # of labels at the same address, the first one defined
+        found = self.addresses[i]
+        name = self.labels[bisect_left(self.addresses, found)][1]
+        return name, addr-found
+
+    def name(self, addr):
+        label = self.label(addr)
+        if label is None:
+            return f"{addr:04x}"
+        name, offset = label
+        return name if offset == 0 else f"{name}+{offset}"
+
+    def describe(self, addr):
+        text = self.name(addr) if self.label(addr) is not None else ""
+        source = self.source(addr)
+        if source is not None:
+            text += f" ({path.basename(source[0])}:{source[1]})"
+        return text.strip()
+
+    def save(self, file_name):
+        with open(file_name, "w") as file:
+            dump({
+                "files": self.files,
+                "lines": self.lines,
+                "labels": self.labels,
+            }, file, separators=(",", ":"))
+
+def read_symbols(file_name):
+    with open(file_name) as file:
+        data = load(file)
+    try:
+        return Symbols(data["files"], map(tuple, data["lines"]), map(tuple, data["labels"]))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"'{file_name}' is not a symbol file")
+
+# the symbol file cmc writes next to an image, if there is one
+def find_symbols(image_name):
+    try:
+        return read_symbols(image_name+".map")
+    except (IOError, ValueError):
+        return None
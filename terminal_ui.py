@@ -1,19 +1,63 @@
 from emulator import Emulator
+from devices import Keyboard, TextDisplay, Timer
+from recorder import Recorder
+from history import History
+from symbols import find_symbols
 from sys import argv
 from time import time, sleep
-from utils import get_character, clear_terminal
+from utils import get_character, Renderer
 
 def color(number):
     return f"\033[{number}m"
 
+def is_hex(text):
+    return len(text) > 0 and all(c in "0123456789abcdef" for c in text.lower())
+
+def parse_condition(parts):
+    checks = []
+    for part in parts:
+        name, _, value = part.lower().partition("=")
+        if not is_hex(value):
+            raise ValueError(f"invalid condition '{part}'")
+        if len(name) == 2 and name[0] == "r" and is_hex(name[1]):
+            checks.append((int(name[1], 16), int(value, 16)))
+        elif name in ("z", "c"):
+            checks.append((name, int(value, 16)))
+        else:
+            raise ValueError(f"invalid condition '{part}'")
+    def condition(emu):
+        for name, value in checks:
+            if name == "z":
+                current = emu.zero
+            elif name == "c":
+                current = emu.carry
+            else:
+                current = emu.registers[name]
+            if current != value:
+                return False
+        return True
+    return condition
+
 class App:
     def __init__(self):
         self.emulator = Emulator()
+        self.keyboard = Keyboard(0x8000)
+        self.display = TextDisplay(0xfe00, 32, 8)
+        self.timer = Timer(0x8010)
+        self.emulator.attach(self.keyboard)
+        self.emulator.attach(self.display)
+        self.emulator.attach(self.timer)
+        self.recorder = Recorder(self.keyboard)
+        self.history = History(self.emulator, self.recorder)
+        self.history.reset()
         self.running = False
         self.m_origin = 0
         self.s_origin = 0xff00
         self.is_auto = False
         self.current_file_name = ""
+        self.symbols = None
+        self.message = ""
+        self.renderer = Renderer()
         if len(argv) > 1:
             file_name = argv[1]
             self.load_program(file_name)
@@ -26,6 +70,7 @@ class App:
             data = input("> ")
             last_auto = self.is_auto
             self.is_auto = False
+            self.message = ""
             if data == "q":
                 self.running = False
             elif len(data) > 1 and data[0].lower() in "ms":
@@ -61,10 +106,22 @@ class App:
             elif len(data) > 2 and data[:2].lower() == "o ":
                 file_name = data[2:].strip()
                 self.load_program(file_name)
+            elif len(data) > 2 and data[:2].lower() == "l ":
+                self.save_recording(data[2:].strip())
             elif len(data) == 1 and data.lower() == "r":
                 self.load_program(self.current_file_name)
             elif len(data) == 1 and data.lower() == "a":
                 self.is_auto = True
+            elif len(data) == 1 and data.lower() == "c":
+                self.continue_()
+            elif data.lower() == "rc":
+                self.reverse_continue()
+            elif len(data) > 0 and data[0].lower() == "u" and (len(data) == 1 or data[1:].isdigit()):
+                self.step_back(int(data[1:]) if len(data) > 1 else 1)
+            elif len(data) > 1 and data[0].lower() == "b":
+                self.toggle_breakpoint(data[1:].split())
+            elif len(data) > 1 and data[0].lower() == "w":
+                self.toggle_watchpoint(data[1:].strip())
             elif len(data) == 2 and data[0] == ",":
                 self.set_interrupt(ord(data[1])&0xff)
             elif len(data) > 1 and data[0] == "." and data[1:].isdigit() and 0<=int(data[1:])<256:
@@ -94,12 +151,16 @@ class App:
             else:
                 self.draw()
     def set_interrupt(self, value):
-        if self.emulator.interrupt_enable:
-            self.emulator.set_interrupt()
-            self.emulator.memory[0x8000] = value
+        self.recorder.press(value)
+    def save_recording(self, file_name):
+        try:
+            self.recorder.save(file_name)
+            self.message = f"Recording saved as '{file_name}'."
+        except IOError as error:
+            self.message = f"Error: {error}."
     def start_auto(self):
         last = 0
-        now = 0
+        now = time()
         timer_step = 0
         timer_draw = 0
         while self.is_auto:
@@ -120,14 +181,79 @@ class App:
             timer_step += dt
             timer_draw += dt
             if timer_step > 1/self.speed:
+                steps = min(int(timer_step*self.speed), self.speed//20+1)
                 timer_step = 0
-                self.step()
+                self.run(steps)
             if timer_draw > 0.05:
                 timer_draw = 0
                 self.draw()
         self.draw()
     def step(self):
         self.emulator.step()
+        self.follow()
+    def run(self, steps):
+        reason, _ = self.emulator.run(max_steps=steps)
+        if reason in ("breakpoint", "watchpoint"):
+            self.is_auto = False
+            self.message = f"Stopped at {reason}."
+        self.follow()
+    def continue_(self):
+        while True:
+            reason, _ = self.emulator.run(max_steps=10000)
+            if reason != "max_steps":
+                break
+            if get_character() == "\x03":
+                reason = "Ctrl+C"
+                break
+        self.message = f"Stopped at {reason}."
+        self.follow()
+    def step_back(self, n):
+        moved = self.history.step_back(n)
+        if moved < n:
+            self.message = "Reached the start of the history."
+        self.follow()
+    def reverse_continue(self):
+        reason = self.history.reverse_continue()
+        self.message = f"Stopped at {reason}."
+        self.follow()
+    def toggle_breakpoint(self, parts):
+        emu = self.emulator
+        if not parts:
+            self.message = "Invalid address ''."
+            return
+        if not is_hex(parts[0]) or int(parts[0], 16) >= 65536:
+            self.message = f"Invalid address '{parts[0]}'."
+            return
+        addr = int(parts[0], 16)
+        if emu.breakpoints[addr] and len(parts) == 1:
+            emu.remove_breakpoint(addr)
+            self.message = f"Breakpoint at {addr:04x} removed."
+            return
+        try:
+            condition = parse_condition(parts[1:]) if len(parts) > 1 else None
+        except ValueError as error:
+            self.message = f"Error: {error}."
+            return
+        emu.add_breakpoint(addr, condition)
+        self.message = f"Breakpoint at {addr:04x} set."
+    def toggle_watchpoint(self, text):
+        emu = self.emulator
+        read = text[:1].lower() == "r"
+        if read:
+            text = text[1:]
+        if not is_hex(text) or int(text, 16) >= 65536:
+            self.message = f"Invalid address '{text}'."
+            return
+        addr = int(text, 16)
+        watches = emu.read_watches if read else emu.write_watches
+        kind = "Read" if read else "Write"
+        if watches[addr]:
+            emu.remove_watchpoint(addr, read=read, write=not read)
+            self.message = f"{kind} watchpoint at {addr:04x} removed."
+        else:
+            emu.add_watchpoint(addr, read=read, write=not read)
+            self.message = f"{kind} watchpoint at {addr:04x} set."
+    def follow(self):
         pc = (self.emulator.program_counter>>4)<<4
         if pc-self.m_origin >= 4*0x0010:
             self.focus_memory_address(pc-3*0x0010)
@@ -140,13 +266,14 @@ class App:
             self.focus_stack_address(sp)
     def load_program(self, file_name):
         try:
-            with open(file_name, "rb") as file:
-                program = file.read()
-            self.emulator.load(program)
+            self.emulator.load_file(file_name)
+            self.symbols = find_symbols(file_name)
+            self.recorder.clear()
+            self.history.reset()
             self.focus_memory_address(0)
             self.focus_stack_address(0)
             self.current_file_name = file_name
-        except IOError:
+        except (IOError, ValueError):
             self.current_file_name = f"invalid file '{file_name}'"
     def focus_memory_address(self, addr):
         self.m_origin = (addr>>4)<<4
@@ -156,63 +283,60 @@ class App:
         self.s_origin = min(self.s_origin, 0xfff0-1*0x0010)
     def draw(self):
         emu = self.emulator
-        screen = ""
+        parts = []
+        add = parts.append
         ins = emu.get_function((emu.memory[emu.program_counter]&0b11111000)>>3).__name__[:3]
         file_name = self.current_file_name
         file_name = (file_name if len(file_name)<40 else (file_name[:38]+"...")).rjust(46)
-        screen += f"{color('31;1')}PC:{color(0)} {emu.program_counter:04x} {file_name}\n"
-        screen += f"{color('31;1')}Z:{color(0)} {emu.zero}        {color('32;1')}next-op: "+color('33;1')+ins+color(0)
-        screen += f"    {color('31;1')}HALTED{color(0)}" if emu.halted else ""
-        screen += f"\n{color('31;1')}C:{color(0)} {emu.carry}"+" "*36+f"speed: {self.speed}".rjust(15)
-        screen += f"\n{color('31;1')}IE:{color(0)} {emu.interrupt_enable}"
-        screen += "\n"+" "*8+color('33;1')
+        add(f"{color('31;1')}PC:{color(0)} {emu.program_counter:04x} {file_name}\n")
+        add(f"{color('31;1')}Z:{color(0)} {emu.zero}        {color('32;1')}next-op: "+color('33;1')+ins+color(0))
+        if self.symbols is not None:
+            add(" "+self.symbols.describe(emu.program_counter)[:28])
+        add(f"    {color('31;1')}HALTED{color(0)}" if emu.halted else "")
+        add(f"\n{color('31;1')}C:{color(0)} {emu.carry}"+" "*36+f"speed: {self.speed}".rjust(15))
+        add(f"\n{color('31;1')}IE:{color(0)} {emu.interrupt_enable}")
+        add("\n"+" "*8+color('33;1'))
         for i in range(16):
-            screen += f"{i:01x}  "
-        screen += f"\n{color('31;1')}regs  : "+color(0)
+            add(f"{i:01x}  ")
+        add(f"\n{color('31;1')}regs  : "+color(0))
         for i in range(16):
-            screen += f"{emu.registers[i]:02x} "
-        screen += f"\n{color('31;1')}memory:{color(0)}\n"
+            add(f"{emu.registers[i]:02x} ")
+        add(f"\n{color('31;1')}memory:{color(0)}\n")
         for i in range(4):
-            screen += f"{color('33;1')}{(self.m_origin+i*16):04x}..: {color(0)}"
+            add(f"{color('33;1')}{(self.m_origin+i*16):04x}..: {color(0)}")
             for j in range(16):
                 addr = self.m_origin+i*16+j
                 if addr == emu.program_counter:
-                    screen += color("44;30;1")
-                screen += f"{emu.memory[addr]:02x}"
-                if addr == emu.program_counter:
-                    screen += color(0)
-                screen += " "
-            screen += "\n"
-        screen += f"{color('31;1')}stack:{color(0)}\n"
+                    add(color("44;30;1"))
+                elif emu.breakpoints[addr]:
+                    add(color("41;30;1"))
+                add(f"{emu.memory[addr]:02x}")
+                if addr == emu.program_counter or emu.breakpoints[addr]:
+                    add(color(0))
+                add(" ")
+            add("\n")
+        add(f"{color('31;1')}stack:{color(0)}\n")
         for i in range(2):
-            screen += f"{color('33;1')}{(self.s_origin++i*16):04x}..: {color(0)}"
+            add(f"{color('33;1')}{(self.s_origin++i*16):04x}..: {color(0)}")
             for j in range(16):
                 addr = self.s_origin+i*16+j
                 if addr == 0xff00|emu.registers[0xf]:
-                    screen += color("44;30;1")
-                screen += f"{emu.memory[addr]:02x}"
+                    add(color("44;30;1"))
+                add(f"{emu.memory[addr]:02x}")
                 if addr == 0xff00|emu.registers[0xf]:
-                    screen += color(0)
-                screen += " "
-            screen += "\n"
-        width = 32
-        height = 8
-        screen += "+"+"-"*width+"+\n"
-        for row in range(height):
-            screen += "|"
-            for column in range(width):
-                byte = emu.memory[0xfe00+row*width+column]
-                if 32 <= byte < 128:
-                    character = chr(byte)
-                else:
-                    character = " "
-                screen += character
-            screen += "|\n"
-        screen += "+"+"-"*width+"+\n"
+                    add(color(0))
+                add(" ")
+            add("\n")
+        width = self.display.width
+        add("+"+"-"*width+"+\n")
+        for row in self.display.rows():
+            add("|"+row+"|\n")
+        add("+"+"-"*width+"+\n")
         if self.is_auto:
-            screen += "Auto mode is active. Ctrl+C to exit."
-        clear_terminal()
-        print(screen)
+            add("Auto mode is active. Ctrl+C to exit.")
+        elif self.message:
+            add(self.message)
+        self.renderer.draw("".join(parts))
 
 def main():
     app = App()
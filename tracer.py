@@ -0,0 +1,100 @@
+from emulator import Emulator
+from symbols import read_symbols
+from array import array
+from sys import argv
+
+MAGIC = b"EMTR"
+RECORD = 7
+
+names = [
+    "???" if function is None else function.__name__[:3]
+    for function, _ in Emulator().table
+]
+
+class Tracer:
+    def __init__(self, size=65536):
+        self.size = size
+        # each record is: PC high, PC low, opcode, operand 1, operand 2,
+        # flags (Z<<1|C) and the stack pointer R[0xf]
+        self.buffer = array("B", bytes(size*RECORD))
+        self.count = 0
+
+    def record(self, emu, pc):
+        B = self.buffer
+        M = emu.memory
+        i = (self.count%self.size)*RECORD
+        B[i] = pc>>8
+        B[i+1] = pc&0xff
+        B[i+2] = M[pc]
+        B[i+3] = M[(pc+1)&0xffff]
+        B[i+4] = M[(pc+2)&0xffff]
+        B[i+5] = (emu.zero<<1)|emu.carry
+        B[i+6] = emu.registers[0xf]
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def raw(self, n=None):
+        kept = min(self.count, self.size)
+        if n is None or n > kept:
+            n = kept
+        end = (self.count%self.size)*RECORD
+        start = end-n*RECORD
+        if start >= 0:
+            return self.buffer[start:end].tobytes()
+        return self.buffer[start:].tobytes()+self.buffer[:end].tobytes()
+
+    def last(self, n=None):
+        return decode(self.raw(n))
+
+    def dump(self, file_name, n=None):
+        data = self.raw(n)
+        with open(file_name, "wb") as file:
+            file.write(MAGIC)
+            file.write((len(data)//RECORD).to_bytes(4, "big"))
+            file.write(data)
+
+def decode(data):
+    return [
+        (
+            (data[i]<<8)|data[i+1],
+            data[i+2], data[i+3], data[i+4],
+            data[i+5], data[i+6],
+        )
+        for i in range(0, len(data), RECORD)
+    ]
+
+def read_trace(file_name):
+    with open(file_name, "rb") as file:
+        data = file.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"'{file_name}' is not a trace file")
+    count = int.from_bytes(data[4:8], "big")
+    return decode(data[8:8+count*RECORD])
+
+def format_entry(entry, symbols=None):
+    pc, opcode, first, second, flags, sp = entry
+    text = f"{pc:04x}: {names[opcode]} {opcode:02x} {first:02x} {second:02x}  Z={flags>>1} C={flags&1} SP={sp:02x}"
+    if symbols is not None:
+        text += "  "+symbols.describe(pc)
+    return text.rstrip()
+
+def main():
+    args = argv[1:]
+    symbols = None
+    if "-m" in args:
+        index = args.index("-m")
+        symbols = read_symbols(args[index+1])
+        args = args[:index]+args[index+2:]
+    if len(args) < 1:
+        print("Usage: tracer.py <trace> [n] [-m <symbols>]")
+        return
+    entries = read_trace(args[0])
+    if len(args) > 1:
+        entries = entries[-int(args[1]):]
+    for entry in entries:
+        print(format_entry(entry, symbols))
+
+if __name__ == "__main__":
+    main()
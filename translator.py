@@ -0,0 +1,323 @@
+from emulator import Emulator, PAGE
+from devices import Keyboard, TextDisplay, Timer
+from functools import partial
+from sys import argv
+
+templates = {
+    "add": ["t = {A}+{B}", "c = t>>8", "{A} = t&0xff", "z = 0 if {A} else 1"],
+    "sub": ["t = {A}-{B}", "c = (t>>8)&1", "{A} = t&0xff", "z = 0 if {A} else 1"],
+    "mul": ["t = {A}*{B}", "{A} = t>>8", "{B} = t&0xff", "c = 1 if {A} else 0", "z = 0 if {B} else 1"],
+    "div": ["high = {A}//{B}", "low = {A}%{B}", "{A} = high", "{B} = low", "c = 1 if {A} else 0", "z = 0 if {B} else 1"],
+    "shl": ["c = ({A}&0x80)>>7", "{A} = ({A}<<{o})&0xff", "z = 0 if {A} else 1"],
+    "shr": ["c = {A}&1", "{A} = {A}>>{o}", "z = 0 if {A} else 1"],
+    "and_": ["{A} = {A}&{B}", "z = 0 if {A} else 1"],
+    "orr": ["{A} = {A}|{B}", "z = 0 if {A} else 1"],
+    "xor": ["{A} = {A}^{B}", "z = 0 if {A} else 1"],
+    "not_": ["{A} = ~{A}&0xff", "z = 0 if {A} else 1"],
+    "psh": ["store(0xff00+rf, {A})", "rf = (rf+1)&0xff"],
+    "pop": ["rf = (rf-1)&0xff", "{A} = M[0xff00+rf]"],
+    "cal": ["store(0xff00+rf, {high})", "rf = (rf+1)&0xff", "store(0xff00+rf, {low})", "rf = (rf+1)&0xff", "pc = {addr}"],
+    "ret": ["rf = (rf-1)&0xff", "t = M[0xff00+rf]", "rf = (rf-1)&0xff", "pc = (M[0xff00+rf]<<8)|t"],
+    "jmp": ["pc = {addr}"],
+    "jif": ["pc = {addr} if {condition} else {next}"],
+    "lod": ["t = ({addr}+re)&0xffff", "{A} = read(t) if io[t>>8] else M[t]", "z = 0 if {A} else 1"],
+    "ldi": ["{A} = {imm}", "z = {zero}"],
+    "sto": ["t = ({addr}+re)&0xffff", "store(t, {A})", "z = 0 if {A} else 1"],
+    "inc": ["t = {A}+1", "c = t>>8", "{A} = t&0xff", "z = 0 if {A} else 1"],
+    "dec": ["t = {A}-1", "c = (t>>8)&1", "{A} = t&0xff", "z = 0 if {A} else 1"],
+    "cmp": ["t = {A}-{B}", "c = (t>>8)&1", "z = 0 if t&0xff else 1"],
+    "nop": [],
+    "hlt": ["emu.halted = True", "pc = {next}"],
+    "mov": ["{B} = {A}"],
+    "rti": [
+        "rf = (rf-1)&0xff", "t = M[0xff00+rf]", "z = (t&0b10)>>1", "c = t&0b01",
+        "rf = (rf-1)&0xff", "t = M[0xff00+rf]", "rf = (rf-1)&0xff", "pc = (M[0xff00+rf]<<8)|t",
+        "emu.interrupt = 0", "emu.interrupt_enable = 1",
+    ],
+    "sei": ["emu.interrupt_enable = 1", "pc = {next}"],
+    "cli": ["emu.interrupt_enable = 0"],
+}
+
+# sei ends a block too, so interrupts become deliverable at exactly the
+# same instruction as in the interpreter
+terminators = ["cal", "ret", "jmp", "jif", "hlt", "rti", "sei"]
+writers = ["psh", "cal", "sto"]
+flagged = [
+    "add", "sub", "mul", "div", "shl", "shr", "and_", "orr", "xor", "not_",
+    "jif", "lod", "ldi", "sto", "inc", "dec", "cmp", "rti",
+]
+
+class BlockEmulator(Emulator):
+    max_block = 64
+
+    def __init__(self):
+        super().__init__()
+        self.blocks = {}
+        self.owners = [None]*65536
+        self.translated = bytearray(65536//PAGE)
+
+    def store(self, addr, value):
+        Emulator.store(self, addr, value)
+        if self.owners[addr]:
+            self.discard(addr)
+
+    def invalidate(self, start, end):
+        Emulator.invalidate(self, start, end)
+        owners = self.owners
+        translated = self.translated
+        for page in range(start//PAGE, (end-1)//PAGE+1):
+            if not translated[page]:
+                continue
+            for addr in range(max(start, page*PAGE), min(end, (page+1)*PAGE)):
+                if owners[addr]:
+                    self.discard(addr)
+
+    def discard(self, addr):
+        for entry in list(self.owners[addr]):
+            block = self.blocks.pop(entry, None)
+            if block is None:
+                continue
+            for a in block[4]:
+                owners = self.owners[a]
+                owners.remove(entry)
+                if not owners:
+                    self.owners[a] = None
+
+    def translate(self, entry):
+        pc = entry
+        lines = []
+        offsets = [0]
+        covered = []
+        used = set()
+        flags = False
+        name = None
+        exit_pc = None
+        while len(offsets) <= self.max_block:
+            function, operands, length = self.predecode(pc)
+            if function is None or function.__name__ not in templates:
+                break
+            name = function.__name__
+            if name == "div" and len(offsets) > 1:
+                # the interpreter raises on division by zero, so div only
+                # ever starts a block and is checked before it runs
+                break
+            next = (pc+length)&0xffff
+            fields = {"next": next}
+            if name in ["cal", "jmp"]:
+                fields["addr"] = operands[0]
+                fields["high"] = (next&0xff00)>>8
+                fields["low"] = next&0x00ff
+            elif name == "jif":
+                zcs, fields["addr"] = operands
+                if zcs in [0b101, 0b011]:
+                    fields["condition"] = "z == 1"
+                elif zcs in [0b100, 0b010]:
+                    fields["condition"] = "z == 0"
+                else:
+                    fields["condition"] = "False"
+            elif name in ["lod", "sto"]:
+                fields["A"] = f"r{operands[0]:x}"
+                fields["addr"] = operands[1]
+            elif name == "ldi":
+                fields["A"] = f"r{operands[0]:x}"
+                fields["imm"] = operands[1]
+                fields["zero"] = int(operands[1] == 0)
+            elif name in ["shl", "shr"]:
+                fields["A"] = f"r{operands[0]:x}"
+                fields["o"] = operands[1]
+            elif len(operands) == 1:
+                fields["A"] = f"r{operands[0]:x}"
+            elif len(operands) == 2:
+                fields["A"] = f"r{operands[0]:x}"
+                fields["B"] = f"r{operands[1]:x}"
+            for key in ["A", "B"]:
+                if key in fields:
+                    used.add(fields[key])
+            if name in ["psh", "pop", "cal", "ret", "rti"]:
+                used.add("rf")
+            if name in ["lod", "sto"]:
+                used.add("re")
+            if name == "div":
+                lines.append(f"if not {fields['B']}:")
+                lines.append(("exit", pc, 0))
+            for template in templates[name]:
+                lines.append(template.format(**fields))
+            flags = flags or name in flagged
+            covered.extend((pc+i)&0xffff for i in range(length))
+            offsets.append(offsets[-1]+length)
+            if name == "sto":
+                # a store to a device may schedule an event
+                lines.append(f"if emu.preempted or {entry} not in blocks:")
+                lines.append(("exit", next, len(offsets)-1))
+            elif name in writers:
+                lines.append(f"if {entry} not in blocks:")
+                # cal has already jumped, so it leaves to its target
+                lines.append(("exit", "pc" if name == "cal" else next, len(offsets)-1))
+            if name in terminators:
+                exit_pc = "pc"
+                break
+            pc = next
+        count = len(offsets)-1
+        if exit_pc is None:
+            exit_pc = pc if count == 0 else next
+        names = sorted(used)
+        enter = [f"{r} = R[{int(r[1], 16)}]" for r in names]
+        leave = [f"R[{int(r[1], 16)}] = {r}" for r in names]
+        if flags:
+            enter += ["z = emu.zero", "c = emu.carry"]
+            leave += ["emu.zero = z", "emu.carry = c"]
+        source = [
+            "def block(emu):",
+            "    R = emu.registers",
+            "    M = emu.memory",
+            "    store = emu.store",
+            "    read = emu.read",
+            "    io = emu.io",
+            "    blocks = emu.blocks",
+        ]
+        source += ["    "+line for line in enter]
+        for line in lines:
+            if isinstance(line, tuple):
+                _, target, steps = line
+                source += ["        "+line for line in leave]
+                source.append(f"        emu.program_counter = {target}")
+                source.append(f"        return {steps}")
+            else:
+                source.append("    "+line)
+        source += ["    "+line for line in leave]
+        source.append(f"    emu.program_counter = {exit_pc}")
+        source.append(f"    return {count}")
+        namespace = {}
+        exec(compile("\n".join(source), f"<block {entry:04x}>", "exec"), namespace)
+        block = (namespace["block"], count, offsets, set(covered[offsets[1]:]) if count else set(), covered)
+        if count:
+            self.blocks[entry] = block
+            for a in covered:
+                self.translated[a//PAGE] = 1
+                if self.owners[a] is None:
+                    self.owners[a] = []
+                self.owners[a].append(entry)
+        return block
+
+    def execute(self, max_steps, until_pc, cycle_budget, resuming):
+        blocks = self.blocks
+        table = self.table
+        M = self.memory
+        steps = 0
+        cycles = 0
+        while steps != max_steps:
+            pc = self.program_counter
+            block = blocks.get(pc)
+            if block is None:
+                block = self.translate(pc)
+            function, count, offsets, inner, _ = block
+            if (
+                count == 0 or until_pc in inner or
+                self.interrupt == 1 and self.interrupt_enable == 1 or
+                max_steps >= 0 and steps+count > max_steps or
+                cycle_budget >= 0 and cycles+offsets[-1] > cycle_budget
+            ):
+                count = 0
+            else:
+                count = function(self)
+            if count:
+                steps += count
+                cycles += offsets[count]
+                if self.interrupt == 1 and self.interrupt_enable == 1:
+                    self.enter_interrupt()
+            else:
+                # fall back to the interpreter for a single instruction
+                cycles += table[M[pc]][1]
+                self.advance()
+                steps += 1
+            if self.halted:
+                return "halted", steps, cycles
+            if self.program_counter == until_pc:
+                return "until_pc", steps, cycles
+            if cycle_budget >= 0 and cycles >= cycle_budget:
+                return "cycle_budget", steps, cycles
+            if self.preempted:
+                return "max_steps", steps, cycles
+        return "max_steps", steps, cycles
+
+def state(emu):
+    return (
+        emu.program_counter, bytes(emu.registers), emu.carry, emu.zero,
+        emu.interrupt, emu.interrupt_enable, emu.halted, bytes(emu.memory),
+        emu.steps, [device.save() for device in emu.attached],
+    )
+
+# devices is called once per engine for the devices to attach, and
+# interrupts are (steps, value) pairs, pressed on the keyboard if one is
+# attached and raised with set_interrupt otherwise
+def prepare(emu, program, devices, interrupts):
+    if devices is not None:
+        for device in devices():
+            emu.attach(device)
+    emu.load_image(program)
+    keyboards = [device for device in emu.attached if isinstance(device, Keyboard)]
+    for steps, value in interrupts:
+        if keyboards:
+            emu.schedule(steps, partial(keyboards[0].press, value))
+        else:
+            emu.schedule(steps, emu.set_interrupt)
+
+def compare(program, max_steps, chunk=1000, devices=None, interrupts=()):
+    reference = Emulator()
+    translated = BlockEmulator()
+    prepare(reference, program, devices, interrupts)
+    prepare(translated, program, devices, interrupts)
+    steps = 0
+    while steps < max_steps:
+        expected = reference.run(max_steps=chunk)
+        got = translated.run(max_steps=chunk)
+        if expected != got or state(reference) != state(translated):
+            return steps
+        steps += expected[1]
+        if reference.halted:
+            break
+    return None
+
+def help():
+    print("""
+Usage:
+    translator.py [OPTIONS] <image> [steps]
+
+Options:
+    -d          Attach the terminal UI devices:
+                keyboard, text display, timer.
+    -i <steps>  Press a key every this many
+                steps.
+""")
+
+def main():
+    args = argv[1:]
+    devices = None
+    every = 0
+    if "-d" in args:
+        args.remove("-d")
+        devices = lambda: [Keyboard(0x8000), TextDisplay(0xfe00, 32, 8), Timer(0x8010)]
+    if "-i" in args:
+        index = args.index("-i")
+        if index+1 >= len(args) or not args[index+1].isdigit() or int(args[index+1]) == 0:
+            print("Error: -i takes a number of steps")
+            return
+        every = int(args.pop(index+1))
+        args.pop(index)
+    if len(args) < 1:
+        help()
+        return
+    with open(args[0], "rb") as file:
+        program = file.read()
+    max_steps = int(args[1]) if len(args) > 1 else 1000000
+    interrupts = []
+    if every:
+        interrupts = [(at, 0x61+i%26) for i, at in enumerate(range(every, max_steps, every))]
+    mismatch = compare(program, max_steps, devices=devices, interrupts=interrupts)
+    if mismatch is None:
+        print("Interpreter and block translator agree.")
+    else:
+        print(f"Mismatch in the chunk starting at step {mismatch}.")
+
+if __name__ == "__main__":
+    main()
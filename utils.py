@@ -1,4 +1,6 @@
 from os import name as os_name
+from shutil import get_terminal_size
+from sys import stdout
 
 if os_name == "posix":
     
@@ -43,3 +45,69 @@ elif os_name == "nt":
     def clear_terminal():
         system("cls")
 
+BLANK = (" ", "0")
+
+# splits text with color codes into rows of (character, style) cells,
+# where the style is every code since the last reset
+def cells(text):
+    rows = []
+    for line in text.split("\n"):
+        row = []
+        style = "0"
+        i = 0
+        while i < len(line):
+            if line.startswith("\033[", i):
+                end = line.find("m", i)
+                code = line[i+2:end]
+                style = "0" if code in ("", "0") else style+";"+code
+                i = end+1
+            else:
+                row.append((line[i], style))
+                i += 1
+        rows.append(row)
+    return rows
+
+# draws frames over the last one, writing only the cells that changed.
+# The cursor is left on the line below the frame, where anything written
+# after it is cleared by the next frame
+class Renderer:
+    def __init__(self, file=stdout):
+        self.file = file
+        self.rows = None
+        self.size = None
+
+    def draw(self, text):
+        rows = cells(text)
+        size = get_terminal_size()
+        out = []
+        # the prompt goes on the line below the frame and Enter moves one
+        # further, so a terminal shorter than that scrolls and positions
+        # no longer match what was drawn
+        if self.rows is None or size != self.size or len(rows)+2 > size.lines:
+            out.append("\033[0m\033[H\033[2J")
+            last = []
+        else:
+            last = self.rows
+        self.size = size
+        at = None
+        style = "0"
+        for y in range(max(len(rows), len(last))):
+            new = rows[y] if y < len(rows) else []
+            old = last[y] if y < len(last) else []
+            for x in range(max(len(new), len(old))):
+                cell = new[x] if x < len(new) else BLANK
+                if cell == (old[x] if x < len(old) else BLANK):
+                    continue
+                if at != (y, x):
+                    out.append(f"\033[{y+1};{x+1}H")
+                if cell[1] != style:
+                    style = cell[1]
+                    out.append(f"\033[{style}m")
+                out.append(cell[0])
+                at = y, x+1
+        if style != "0":
+            out.append("\033[0m")
+        out.append(f"\033[{len(rows)+1};1H\033[J")
+        self.file.write("".join(out))
+        self.file.flush()
+        self.rows = rows